@@ -0,0 +1,75 @@
+"""
+Compare the end-to-end latency of handing over messages from a broker client
+thread into the pipeline, using polling (``delivery=poll``) vs. wakeups
+through the event loop (``delivery=async``).
+
+A producer thread stands in for the network thread of an MQTT or AMQP client,
+and delivers timestamps at a given rate. The pipeline's sink computes the
+delay between producing and receiving each message.
+
+Synopsis::
+
+    python benchmarks/source_latency.py --rate=1000 --count=5000
+"""
+
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+
+from streamz import from_q
+from tornado.ioloop import IOLoop
+
+from lorrystream.streamz.buffer import BoundedBuffer
+from lorrystream.streamz.sources import AsyncDelivery
+
+
+class SyntheticSource(AsyncDelivery, from_q):
+    def __init__(self, delivery: str, **kwargs):
+        self._setup_delivery({"delivery": delivery})
+        super().__init__(q=BoundedBuffer(), **kwargs)
+
+
+async def measure(delivery: str, rate: float, count: int):
+    source = SyntheticSource(delivery=delivery, loop=IOLoop.current())
+    latencies = []
+    done = asyncio.Event()
+
+    def sink(sent_at: float):
+        latencies.append(time.perf_counter() - sent_at)
+        if len(latencies) >= count:
+            done.set()
+
+    def produce():
+        interval = 1.0 / rate
+        for _ in range(count):
+            source.deliver(time.perf_counter())
+            time.sleep(interval)
+
+    source.sink(sink)
+    source.start()
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    await done.wait()
+    source.stop()
+    producer.join()
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return quantiles[49], quantiles[98]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=1000, help="Messages per second")
+    parser.add_argument("--count", type=int, default=5000, help="Number of messages")
+    args = parser.parse_args()
+
+    print(f"Delivering {args.count} messages at {args.rate:.0f} messages/s")
+    for delivery in ["poll", "async"]:
+        p50, p99 = await measure(delivery, rate=args.rate, count=args.count)
+        print(f"delivery={delivery:<5}  p50={p50 * 1000:8.3f} ms  p99={p99 * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,255 @@
+"""
+Measure the end-to-end throughput of channels relaying synthetic MQTT and AMQP
+traffic into a database, driving ``ChannelFactory`` and ``Engine``.
+
+The brokers are replaced by in-process fakes: a producer thread stands in for
+the network thread of the MQTT or AMQP client library, and delivers messages
+of a given size at a given rate through the source element's regular message
+callback. This way, the benchmark covers buffering, batching, decoding, and
+writing to the database, without needing any auxiliary services.
+
+Each message carries the time it has been produced. After a batch has been
+written to the database, the latency of each of its messages is computed.
+The report includes throughput in messages and megabytes per second, the p50
+and p99 latencies, and the peak resident set size of the process.
+
+Synopsis::
+
+    python benchmarks/throughput.py --count=50000 --size=256
+    python benchmarks/throughput.py --transport=mqtt --rate=5000 --count=20000
+    python benchmarks/throughput.py --format=records --batch-size=5000
+
+By default, data is written to a temporary SQLite database. Use ``--dburi``
+to write to another database, e.g. ``duckdb:///benchmark.duckdb`` when the
+``duckdb-engine`` package is installed.
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import typing as t
+from unittest import mock
+
+import orjson
+import paho.mqtt.client
+import pandas as pd
+import pika
+from paho.mqtt.client import MQTTMessage
+from pika.spec import Basic
+
+from lorrystream.core import ChannelFactory, Engine
+from lorrystream.model import BatchPolicy
+from lorrystream.streamz.sources import FromAmqp
+
+
+class Producer:
+    """
+    Produce JSON messages of approximately ``size`` bytes at ``rate`` messages per second, on a thread.
+
+    A rate of zero produces messages as fast as possible.
+    """
+
+    def __init__(self, deliver: t.Callable[[bytes], None], count: int, rate: float, size: int):
+        self.deliver = deliver
+        self.count = count
+        self.rate = rate
+        self.padding = "x" * max(size - len(orjson.dumps({"seq": 0, "ts": time.perf_counter(), "data": ""})), 0)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="benchmark-producer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        started = time.perf_counter()
+        for seq in range(self.count):
+            if self.stopped.is_set():
+                break
+            if self.rate:
+                ahead = started + seq / self.rate - time.perf_counter()
+                if ahead > 0.001:
+                    time.sleep(ahead)
+            self.deliver(orjson.dumps({"seq": seq, "ts": time.perf_counter(), "data": self.padding}))
+
+
+class FakeMqttClient:
+    """
+    Stand-in for ``paho.mqtt.client.Client``, delivering synthetic messages on a producer thread.
+    """
+
+    options: t.Dict[str, t.Any] = {}
+
+    def __init__(self, *args, **kwargs):
+        self.on_connect: t.Optional[t.Callable] = None
+        self.on_message: t.Optional[t.Callable] = None
+        self.producer = Producer(self.publish, **self.options)
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def connect(self, host, port=1883, keepalive=60, **kwargs):
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+
+    def subscribe(self, topic, qos=0):
+        pass
+
+    def loop_start(self):
+        self.producer.start()
+
+    def disconnect(self):
+        self.producer.stop()
+
+    def publish(self, payload: bytes):
+        msg = MQTTMessage(mid=0, topic=b"benchmark/readings")
+        msg.payload = payload
+        self.on_message(self, None, msg)  # type: ignore[misc]
+
+
+class FakeAmqpConsumer:
+    """
+    Stand-in for ``AMQPAdapter``, delivering synthetic messages on the consumer thread.
+    """
+
+    options: t.Dict[str, t.Any] = {}
+
+    def __init__(self, on_message: t.Callable):
+        self.on_message = on_message
+        self.properties = pika.BasicProperties(content_type="application/json")
+        self.delivery_tag = 0
+        self.producer = Producer(self.publish, **self.options)
+
+    def publish(self, body: bytes):
+        self.delivery_tag += 1
+        basic_deliver = Basic.Deliver(
+            consumer_tag="benchmark", delivery_tag=self.delivery_tag, exchange="", routing_key="benchmark"
+        )
+        self.on_message(None, basic_deliver, self.properties, body)
+
+    def run(self):
+        self.producer.run()
+
+    def stop(self):
+        self.producer.stop()
+
+
+def fake_amqp_consumer_factory(self: FromAmqp, queue: t.Optional[str] = None):
+    return FakeAmqpConsumer(on_message=self._on_message)
+
+
+TRANSPORTS = {
+    "mqtt": "mqtt://localhost/benchmark/%23?content-type=json",
+    "amqp": "amqp://localhost/%2F?queue=benchmark&content-type=json",
+}
+
+
+async def measure(transport: str, dburi: str, sink_format: str, batch: BatchPolicy, count: int, rate: float, size: int):
+    options = {"count": count, "rate": rate, "size": size}
+    latencies: t.List[float] = []
+    done = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    def record(data):
+        now = time.perf_counter()
+        if isinstance(data, pd.DataFrame):
+            timestamps = data["ts"].tolist()
+        else:
+            timestamps = [item["ts"] for item in data]
+        latencies.extend(now - ts for ts in timestamps)
+        if len(latencies) >= count:
+            loop.call_soon_threadsafe(done.set)
+
+    with (
+        mock.patch.object(FakeMqttClient, "options", options),
+        mock.patch.object(FakeAmqpConsumer, "options", options),
+        mock.patch.object(paho.mqtt.client, "Client", FakeMqttClient),
+        mock.patch.object(FromAmqp, "consumer_factory", fake_amqp_consumer_factory),
+    ):
+        channel = ChannelFactory(
+            source=TRANSPORTS[transport],
+            sink=f"{dburi}?table=benchmark_{transport}&format={sink_format}",
+            batch=batch,
+            name=transport,
+        ).channel()
+        channel.tap(record)
+
+        engine = Engine()
+        engine.register(channel)
+        started = time.perf_counter()
+        engine.start()
+        while not done.is_set():
+            if channel.metrics.errors:
+                raise RuntimeError(f"Writing to the sink failed, see log output: {dburi}")
+            try:
+                await asyncio.wait_for(done.wait(), timeout=0.5)
+            except asyncio.TimeoutError:
+                pass
+        duration = time.perf_counter() - started
+        engine.stop()
+        channel.sink.destroy()
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "rate": count / duration,
+        "throughput": channel.metrics.bytes_in / duration / 1024 / 1024,
+        "p50": quantiles[49],
+        "p99": quantiles[98],
+    }
+
+
+def peak_rss() -> float:
+    """
+    Return the peak resident set size of the process in megabytes.
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    if sys.platform == "darwin":
+        return maxrss / 1024 / 1024
+    return maxrss / 1024
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transport", choices=["all", *TRANSPORTS], default="all", help="Source transport")
+    parser.add_argument("--count", type=int, default=20_000, help="Number of messages")
+    parser.add_argument("--rate", type=float, default=0, help="Messages per second, 0 for unlimited")
+    parser.add_argument("--size", type=int, default=256, help="Approximate message size in bytes")
+    parser.add_argument("--format", choices=["dataframe", "records"], default="dataframe", help="Sink format")
+    parser.add_argument("--batch-size", type=int, default=1_000, help="Maximum number of records per batch")
+    parser.add_argument("--dburi", type=str, help="SQLAlchemy database URI, defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    transports = list(TRANSPORTS) if args.transport == "all" else [args.transport]
+    batch = BatchPolicy(size=args.batch_size)
+
+    print(
+        f"Relaying {args.count} messages of {args.size} bytes at "
+        f"{f'{args.rate:.0f} messages/s' if args.rate else 'full speed'}, format={args.format}"
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Sink URIs do not retain absolute SQLite paths, so use a relative one.
+        if args.dburi is None:
+            os.chdir(tmpdir)
+        dburi = args.dburi or "sqlite:///benchmark.sqlite"
+        for transport in transports:
+            result = await measure(
+                transport, dburi, args.format, batch, count=args.count, rate=args.rate, size=args.size
+            )
+            print(
+                f"transport={transport:<4}  {result['rate']:10.0f} msgs/s  {result['throughput']:8.2f} MB/s  "
+                f"p50={result['p50'] * 1000:8.2f} ms  p99={result['p99'] * 1000:8.2f} ms  "
+                f"peak_rss={peak_rss():.0f} MB"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
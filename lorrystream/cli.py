@@ -5,6 +5,8 @@ import click
 
 from lorrystream import parse_launch
 from lorrystream.core import run_single
+from lorrystream.model import BatchPolicy
+from lorrystream.supervisor import run_sharded
 from lorrystream.util.about import AboutReport
 from lorrystream.util.aio import make_sync
 from lorrystream.util.cli import boot_click, docstring_format_verbatim
@@ -32,6 +34,21 @@ def help_relay():
         "amqp://localhost/testdrive/demo" \\
         "mqtt://localhost/testdrive/demo"
 
+    # Decode and relay messages on four worker processes.
+    lorry relay --workers=4 \\
+        "amqp://localhost/%2F?queue=testdrive&content-type=json" \\
+        "crate://localhost/testdrive/data"
+
+    # Flush batches of up to 5000 records, or after 1 second at the latest.
+    lorry relay --batch-size=5000 --batch-timeout=1.0 \\
+        "mqtt://localhost/testdrive/#" \\
+        "crate://localhost/testdrive/data"
+
+    # Log metrics every 10 seconds, and serve them for Prometheus.
+    lorry relay --metrics-interval=10 --metrics-port=9100 \\
+        "mqtt://localhost/testdrive/#" \\
+        "crate://localhost/testdrive/data"
+
     """  # noqa: E501
 
 
@@ -77,8 +94,50 @@ def launch(ctx: click.Context, command: t.Tuple[str]):
 )
 @click.argument("source", type=str, required=True)
 @click.argument("sink", type=str, required=False)
+@click.option("--batch-size", type=int, required=False, help="Maximum number of records per batch")
+@click.option("--batch-bytes", type=int, required=False, help="Maximum number of payload bytes per batch")
+@click.option("--batch-timeout", type=float, required=False, help="Maximum linger time of a batch in seconds")
+@click.option("--batch-adaptive", is_flag=True, default=None, help="Grow batch size when the sink falls behind")
+@click.option("--workers", type=int, default=1, help="Number of worker processes. Use 0 for one per CPU core")
+@click.option("--metrics-interval", type=float, required=False, help="Log metrics every N seconds")
+@click.option("--metrics-port", type=int, required=False, help="Serve metrics in Prometheus format on this port")
+@click.option(
+    "--drain-timeout", type=float, default=10.0, help="Seconds to wait for writing in-flight messages on shutdown"
+)
 @click.pass_context
 @make_sync
-async def relay(ctx: click.Context, source: str, sink: str):
+async def relay(
+    ctx: click.Context,
+    source: str,
+    sink: str,
+    batch_size: t.Optional[int],
+    batch_bytes: t.Optional[int],
+    batch_timeout: t.Optional[float],
+    batch_adaptive: t.Optional[bool],
+    workers: int,
+    metrics_interval: t.Optional[float],
+    metrics_port: t.Optional[int],
+    drain_timeout: float,
+):
     logger.info("Starting")
-    await run_single(source, sink)
+    batch = None
+    batch_options = {
+        "batch-size": batch_size,
+        "batch-bytes": batch_bytes,
+        "batch-timeout": batch_timeout,
+        "batch-adaptive": batch_adaptive,
+    }
+    batch_options = {key: value for key, value in batch_options.items() if value is not None}
+    if batch_options:
+        batch = BatchPolicy.from_options(batch_options)
+    if workers == 1:
+        await run_single(
+            source,
+            sink,
+            batch=batch,
+            metrics_interval=metrics_interval,
+            metrics_port=metrics_port,
+            drain_timeout=drain_timeout,
+        )
+    else:
+        await run_sharded(source, sink, workers=workers or None, batch=batch)
@@ -2,40 +2,65 @@ import asyncio
 import json
 import logging
 import operator
+import signal
 import typing as t
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
+import orjson
 from streamz import Sink, Source, Stream
 from streamz.batch import Batch
 
-from lorrystream.exceptions import InvalidContentTypeError, InvalidSinkError, InvalidSourceError
-from lorrystream.model import Channel, Packet, SinkInputType, StreamAddress
+from lorrystream.exceptions import (
+    InvalidChannelError,
+    InvalidContentTypeError,
+    InvalidSinkError,
+    InvalidSourceError,
+)
+from lorrystream.metrics import ChannelMetrics, MetricsServer, render_prometheus
+from lorrystream.model import BatchPolicy, Channel, ChannelState, Packet, SinkInputType, StreamAddress
+from lorrystream.streamz.batch import micro_batch  # noqa: F401
 from lorrystream.streamz.model import BusMessage
+from lorrystream.streamz.sinks import dataframe_to_sql, records_to_sql, to_amqp  # noqa: F401
+from lorrystream.util.aio import get_running_io_loop
 from lorrystream.util.data import get_sqlalchemy_dialects
 
 logger = logging.getLogger(__name__)
 
 
-async def run_single(source_uri: str, sink_uri: str):
+async def run_single(
+    source_uri: str,
+    sink_uri: str,
+    batch: t.Optional[BatchPolicy] = None,
+    metrics_interval: t.Optional[float] = None,
+    metrics_port: t.Optional[int] = None,
+    drain_timeout: float = 10.0,
+):
     """
-    Create a single channel and run it on the engine, blocking forever.
+    Create a single channel and run it on the engine, blocking until terminated.
 
     :param source_uri: Source element URI
     :param sink_uri: Sink element URI
+    :param batch: Batching policy, overriding the ``batch-*`` URI query parameters
+    :param metrics_interval: Number of seconds between log lines reporting metrics
+    :param metrics_port: Port number for serving metrics in Prometheus text format
+    :param drain_timeout: Number of seconds to wait for in-flight messages to be written on shutdown
     :return:
     """
 
     # Create channel.
-    channel = ChannelFactory(source=source_uri, sink=sink_uri).channel()
+    channel = ChannelFactory(source=source_uri, sink=sink_uri, batch=batch).channel()
 
     # Run channel with engine.
-    engine = Engine()
+    engine = Engine(metrics_interval=metrics_interval, metrics_port=metrics_port, drain_timeout=drain_timeout)
     engine.register(channel)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, engine.terminate)
     await engine.run_forever()
 
 
 async def run_channels(*channels: Channel):
     """
-    Obtain multiple channel objects and run them on the engine, blocking forever.
+    Obtain multiple channel objects and run them on the engine, blocking until terminated.
 
     :param channels: List of channel objects
     :return:
@@ -43,6 +68,7 @@ async def run_channels(*channels: Channel):
     engine = Engine()
     for channel in channels:
         engine.register(channel)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, engine.terminate)
     await engine.run_forever()
 
 
@@ -86,17 +112,92 @@ class Decoders:
         return Packet(payload=json.loads(busmsg.data.payload), busmsg=busmsg)
 
 
+class BatchDecoders:
+    """
+    Decode whole batches of `BusMessage` objects into lists of `Packet` objects in one pass.
+
+    Compared to applying per-message decoders one by one, this saves one
+    Python function call and one intermediary `Packet` per message and
+    decoder, and uses `orjson` for parsing JSON.
+    """
+
+    @staticmethod
+    def decode_busmessages(batch: t.Sequence[BusMessage]) -> t.List[Packet]:
+        """
+        Decode batch of `BusMessage` objects into `Packet` objects, without decoding their payloads.
+        """
+        return [Packet(payload=busmsg.data.payload, busmsg=busmsg) for busmsg in batch]
+
+    @staticmethod
+    def decode_busmessages_json(batch: t.Sequence[BusMessage]) -> t.List[Packet]:
+        """
+        Decode batch of `BusMessage` objects with JSON payloads into `Packet` objects.
+
+        Messages with invalid or empty payloads are logged and skipped.
+        """
+        raw: t.List[t.Any] = [busmsg.data.payload for busmsg in batch]
+        try:
+            payloads = list(map(orjson.loads, raw))
+        except (orjson.JSONDecodeError, TypeError):
+            return BatchDecoders._decode_busmessages_json_lenient(batch)
+        return [Packet(payload=payload, busmsg=busmsg) for payload, busmsg in zip(payloads, batch)]
+
+    @staticmethod
+    def _decode_busmessages_json_lenient(batch: t.Sequence[BusMessage]) -> t.List[Packet]:
+        packets = []
+        for busmsg in batch:
+            raw: t.Any = busmsg.data.payload
+            try:
+                packets.append(Packet(payload=orjson.loads(raw), busmsg=busmsg))
+            except (orjson.JSONDecodeError, TypeError) as ex:
+                logger.warning(f"Skipping message with invalid JSON payload: {ex}. Payload: {busmsg.data.payload!r}")
+        return packets
+
+
+class ShardFilter:
+    """
+    Select the share of messages belonging to a shard, by hashing their payloads.
+
+    Used when multiple worker processes consume the same channel from a
+    broker which delivers all messages to all subscribers, like MQTT.
+    """
+
+    def __init__(self, index: int, count: int):
+        if not 0 <= index < count:
+            raise ValueError(f"Invalid shard {index} of {count}")
+        self.index = index
+        self.count = count
+
+    def __call__(self, busmsg: BusMessage) -> bool:
+        payload = busmsg.data.payload
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        return zlib.crc32(payload or b"") % self.count == self.index
+
+
 class ChannelFactory:
-    def __init__(self, source: str, sink: SinkInputType):
+    def __init__(
+        self,
+        source: str,
+        sink: SinkInputType,
+        batch: t.Optional[BatchPolicy] = None,
+        name: t.Optional[str] = None,
+        shard: t.Optional[t.Tuple[int, int]] = None,
+    ):
+        self.name = name
+        self.shard = shard
+        self.metrics = ChannelMetrics()
+
+        # Run the pipeline on the caller's event loop, so sources deliver messages directly into the
+        # loop `Engine.run_forever` runs on. Without a running loop, streamz starts one on a thread.
+        self.loop = get_running_io_loop()
         self.source_element: Source = None
         self.sink_element: t.Union[Sink, t.Callable] = None
+        self.decoder: t.Callable = BatchDecoders.decode_busmessages
         self.transformers: t.List[t.Callable] = []
+        self.batcher: Stream = None
         self.pipeline: t.Union[Batch, Stream] = None
 
-        # FIXME: Obtain parameters from user.
-        self.batch_size = 2
-        self.timeout = 0.25
-
         # When no sink is specified, use STDOUT.
         # TODO: How to use `sys.stdout.buffer.write` instead?
         if sink is None:
@@ -105,6 +206,12 @@ class ChannelFactory:
         self.source_address = StreamAddress.from_url(source)
         self.sink_address = StreamAddress.resolve_sink(sink)
 
+        # Batching policy. Options on the sink address take precedence over the
+        # ones on the source address, an explicit policy object overrides both.
+        if batch is None:
+            batch = BatchPolicy.from_options({**self.source_address.options, **self.sink_address.options})
+        self.batch = batch
+
         # Select source element for pipeline.
         self.select_source(source)
 
@@ -121,33 +228,47 @@ class ChannelFactory:
         uri = self.source_address.uri
         if uri.scheme.startswith("amqp"):
             logger.info("Subscribing to AMQP")
-            self.source_element = Stream.from_amqp(self.source_address)
-            self.transformers.append(Decoders.decode_busmessage)
+            self.source_element = Stream.from_amqp(self.source_address, loop=self.loop)
 
         elif uri.scheme.startswith("mqtt"):
-            self.source_element = Stream.from_mqtt_plus(uri)
-            self.transformers.append(Decoders.decode_busmessage)
+            self.source_element = Stream.from_mqtt_plus(self.source_address, loop=self.loop)
 
         else:
             raise InvalidSourceError(f"Source scheme unknown: {uri.scheme}")
 
+        if self.source_address.options.get("ack") == "batch" and not hasattr(self.source_element, "acknowledge"):
+            raise InvalidSourceError(f"Source does not support acknowledgements: {uri.scheme}")
+
         if "content-type" in self.source_address.options:
             source_content_type = self.source_address.options["content-type"]
             if source_content_type == "json":
-                self.transformers.append(Decoders.decode_json)
+                self.decoder = BatchDecoders.decode_busmessages_json
             else:
                 raise InvalidContentTypeError(f"Invalid content type for source '{uri}': {source_content_type}")
 
     def mkpipeline(self):
         """
-        n: int
-            Maximum partition size
-        timeout: int or float, optional
-            Number of seconds after which a partition will be emitted,
-            even if its size is less than ``n``. If ``None`` (default),
-            a partition will be emitted only when its size reaches ``n``.
+        Create the micro-batching stage, decode batches, and apply all transformers.
+
+        Batches are emitted according to ``self.batch``, see ``BatchPolicy``.
+        Each batch is decoded in one pass, see ``BatchDecoders``.
+        Batches and decoding times are recorded into ``self.metrics``.
+        With ``ack=batch``, batches are acknowledged after the sink has written them.
+
+        When the channel is a shard of a channel consumed by multiple workers,
+        only process the corresponding share of messages. AMQP brokers already
+        distribute messages across consumers of the same queue.
         """
-        self.pipeline = self.source_element.partition(n=self.batch_size, timeout=self.timeout).to_batch()
+        stream = self.source_element
+        if self.shard is not None and not self.source_address.uri.scheme.startswith("amqp"):
+            stream = stream.filter(ShardFilter(*self.shard))
+        self.batcher = stream.micro_batch(policy=self.batch)
+        self.batcher.sink(self.metrics.record_batch)
+        batches = self.batcher
+        if self.source_address.options.get("ack") == "batch":
+            batches = batches.acknowledge(ack=self.source_element.acknowledge, reject=self.source_element.reject)
+        self.pipeline = batches.to_batch()
+        self.pipeline = self.pipeline.map_partitions(self.metrics.timed_decoder(self.decoder), self.pipeline)
         for transformer in self.transformers:
             self.pipeline = self.pipeline.map(transformer)
 
@@ -159,14 +280,29 @@ class ChannelFactory:
         uri = self.sink_address.uri
 
         if uri.scheme.startswith("callable"):
-            self.sink_element = self.pipeline.stream.sink(location)
+            self.sink_element = self.pipeline.stream.sink(self.metrics.timed_sink(t.cast(t.Callable, location)))
 
         elif uri.scheme in db_dialects:
             # TODO: Weave in more sophisticated transformations here,
             #       like topic/topology/storage convergence from Kotori.
-            self.pipeline = self.pipeline.map(operator.attrgetter("payload")).to_dataframe()
+            sink_format = self.sink_address.options.get("format", "dataframe")
+            if sink_format == "dataframe":
+                self.pipeline = self.pipeline.map(operator.attrgetter("payload")).to_dataframe()
+                self.sink_element = self.pipeline.stream.dataframe_to_sql(
+                    dburi=str(self.sink_address.uri), metrics=self.metrics
+                )
+            elif sink_format == "records":
+                self.pipeline = self.pipeline.map_partitions(Packet.payloads, self.pipeline)
+                self.sink_element = self.pipeline.stream.records_to_sql(
+                    dburi=str(self.sink_address.uri), metrics=self.metrics
+                )
+            else:
+                raise InvalidSinkError(f"Invalid sink format: {sink_format}")
+
+        elif uri.scheme.startswith("amqp"):
+            self.pipeline = self.pipeline.map_partitions(Packet.payloads, self.pipeline)
+            self.sink_element = self.pipeline.stream.to_amqp(address=self.sink_address, metrics=self.metrics)
 
-            self.sink_element = self.pipeline.stream.dataframe_to_sql(dburi=str(self.sink_address.uri))
         else:
             raise InvalidSinkError(f"Invalid sink location: {location}. Scheme unknown: {uri.scheme}.")
 
@@ -178,29 +314,213 @@ class ChannelFactory:
         """
         Produce `Channel` object from elements.
         """
-        return Channel(source=self.source_element, pipeline=self.pipeline, sink=self.sink_element)
+        return Channel(
+            source=self.source_element,
+            pipeline=self.pipeline,
+            sink=self.sink_element,
+            name=self.name,
+            metrics=self.metrics,
+            batcher=self.batcher,
+        )
 
 
 class Engine:
-    def __init__(self):
+    """
+    Run multiple channels, each identified by a unique name, and manage their lifecycle individually.
+
+    Starting or stopping one channel failing does not affect the others. Channels are
+    stopped concurrently, so a slow source does not delay shutting down the others.
+
+    When terminated, ``run_forever`` drains all channels, see ``drain``, giving up
+    after ``drain_timeout`` seconds.
+    """
+
+    def __init__(
+        self,
+        metrics_interval: t.Optional[float] = None,
+        metrics_port: t.Optional[int] = None,
+        drain_timeout: float = 10.0,
+    ):
         self.channels: t.Dict[str, Channel] = {}
+        self.states: t.Dict[str, ChannelState] = {}
+        self.metrics_interval = metrics_interval
+        self.drain_timeout = drain_timeout
+        self.metrics_server = MetricsServer(self.metrics_text, port=metrics_port) if metrics_port is not None else None
         self._terminate_event = asyncio.Event()
 
-    def register(self, channel: Channel):
-        logger.info(f"Registering channel: {channel}")
-        # FIXME: The registry is currently a bit naive.
-        name = str(channel.source)
+    def register(self, channel: Channel, name: t.Optional[str] = None) -> str:
+        """
+        Register a channel, and return its name.
+
+        When no name is given, use the channel's name, or derive a sequential one.
+        """
+        name = name or channel.name or f"channel-{len(self.channels) + 1}"
+        if name in self.channels:
+            raise InvalidChannelError(f"Channel already registered: {name}")
+        logger.info(f"Registering channel {name}: {channel}")
+        channel.name = name
         self.channels[name] = channel
+        self.states[name] = ChannelState.REGISTERED
+        return name
 
-    def start(self):
+    def unregister(self, name: str):
+        """
+        Stop and remove a channel.
+        """
+        self.stop_channel(name)
+        del self.channels[name]
+        del self.states[name]
+
+    def get_channel(self, name: str) -> Channel:
+        try:
+            return self.channels[name]
+        except KeyError as ex:
+            raise InvalidChannelError(f"Channel not registered: {name}") from ex
+
+    def queue_depths(self) -> t.Dict[str, int]:
+        """
+        Report the number of messages waiting in the buffers of all channel sources.
+        """
+        depths = {}
         for name, channel in self.channels.items():
-            logger.info(f"Starting channel {name}")
-            channel.source.start()
+            buffer = getattr(channel.source, "q", None)
+            if buffer is not None:
+                depths[name] = buffer.qsize()
+        return depths
+
+    def metrics(self) -> t.Dict[str, ChannelMetrics]:
+        """
+        Report the metrics of all channels.
+        """
+        return {name: channel.metrics for name, channel in self.channels.items()}
+
+    def metrics_text(self) -> str:
+        """
+        Render the metrics of all channels, and the state of their source buffers, in Prometheus text format.
+        """
+        gauges: t.Dict[str, t.Dict[str, float]] = {"queue_depth": {}, "queue_dropped": {}, "queue_spilled": {}}
+        for name, channel in self.channels.items():
+            buffer = getattr(channel.source, "q", None)
+            if buffer is None:
+                continue
+            gauges["queue_depth"][name] = buffer.qsize()
+            gauges["queue_dropped"][name] = getattr(buffer, "dropped", 0)
+            gauges["queue_spilled"][name] = getattr(buffer, "spilled", 0)
+        return render_prometheus(self.metrics(), gauges)
+
+    async def report_metrics(self, interval: float):
+        """
+        Log a line with the metrics of each channel periodically.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            depths = self.queue_depths()
+            for name, metrics in self.metrics().items():
+                logger.info(f"Metrics of channel {name}: {metrics.summary()} queue={depths.get(name, 0)}")
+
+    def start(self):
+        """
+        Start all channels.
+        """
+        for name in list(self.channels):
+            self.start_channel(name)
 
     def stop(self):
-        for channel in self.channels.values():
-            logger.info(f"Stopping channel {channel}")
+        """
+        Stop all channels concurrently.
+
+        Messages which have not been written to the sink yet are discarded, see ``drain``.
+        """
+        if not self.channels:
+            return
+        with ThreadPoolExecutor(max_workers=len(self.channels), thread_name_prefix="lorry-stop") as executor:
+            list(executor.map(self.stop_channel, list(self.channels)))
+
+    def start_channel(self, name: str) -> bool:
+        """
+        Start a single channel. Return whether it has been started successfully.
+        """
+        channel = self.get_channel(name)
+        logger.info(f"Starting channel {name}")
+        try:
+            channel.source.start()
+        except Exception:
+            logger.exception(f"Starting channel {name} failed")
+            self.states[name] = ChannelState.FAILED
+            return False
+        self.states[name] = ChannelState.RUNNING
+        return True
+
+    def stop_channel(self, name: str) -> bool:
+        """
+        Stop a single channel. Return whether it has been stopped successfully.
+        """
+        channel = self.get_channel(name)
+        if self.states[name] != ChannelState.RUNNING:
+            return True
+        logger.info(f"Stopping channel {name}")
+        try:
             channel.source.stop()
+        except Exception:
+            logger.exception(f"Stopping channel {name} failed")
+            self.states[name] = ChannelState.FAILED
+            return False
+        self.states[name] = ChannelState.STOPPED
+        return True
+
+    async def drain(self, timeout: t.Optional[float] = None) -> bool:
+        """
+        Stop all channels concurrently, and write their in-flight messages to the sink.
+
+        Channels still draining after ``timeout`` seconds are stopped, discarding the
+        messages they did not write yet. Return whether all channels have been drained.
+        """
+        names = [name for name, state in self.states.items() if state == ChannelState.RUNNING]
+        if not names:
+            return True
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*map(self.drain_channel, names)),
+                timeout=self.drain_timeout if timeout is None else timeout,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Draining channels did not finish in time, discarding in-flight messages: {names}")
+            self.stop()
+            return False
+        return all(results)
+
+    async def drain_channel(self, name: str) -> bool:
+        """
+        Stop a single channel, and write its in-flight messages to the sink.
+
+        First, the source stops receiving messages. Then, the messages remaining in
+        its buffer are emitted into the pipeline, and the partial batch is flushed.
+        Finally, the connections of sink and source are closed. Return whether it succeeded.
+        """
+        channel = self.get_channel(name)
+        if self.states[name] != ChannelState.RUNNING:
+            return True
+        logger.info(f"Draining channel {name}")
+        try:
+            if hasattr(channel.source, "drain"):
+                await channel.source.drain()
+            if channel.batcher is not None:
+                await channel.batcher.flush()
+            if hasattr(channel.sink, "close"):
+                channel.sink.close()
+        except Exception:
+            logger.exception(f"Draining channel {name} failed")
+            self.stop_channel(name)
+            self.states[name] = ChannelState.FAILED
+            return False
+        return self.stop_channel(name)
+
+    def restart_channel(self, name: str) -> bool:
+        """
+        Restart a single channel, without affecting the others.
+        """
+        self.stop_channel(name)
+        return self.start_channel(name)
 
     def terminate(self):
         self._terminate_event.set()
@@ -208,5 +528,17 @@ class Engine:
     async def run_forever(self):
         # Start engine.
         self.start()
-        # Wait forever.
-        await self._terminate_event.wait()
+        reporter = None
+        if self.metrics_interval:
+            reporter = asyncio.create_task(self.report_metrics(self.metrics_interval))
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        # Wait until terminated, then write in-flight messages.
+        try:
+            await self._terminate_event.wait()
+        finally:
+            await self.drain()
+            if reporter is not None:
+                reporter.cancel()
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
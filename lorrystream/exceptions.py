@@ -8,3 +8,7 @@ class InvalidContentTypeError(Exception):
 
 class InvalidSinkError(Exception):
     pass
+
+
+class InvalidChannelError(Exception):
+    pass
@@ -0,0 +1,226 @@
+"""
+Instrumentation of channels.
+
+Each channel owns a ``ChannelMetrics`` instance, which is updated once per
+batch, not per message, so it is cheap enough to leave on in production.
+The engine exposes the metrics of all its channels in Prometheus text
+format, per ``MetricsServer``, or as a periodic log line.
+"""
+
+import bisect
+import dataclasses
+import logging
+import threading
+import time
+import typing as t
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000)
+
+
+class Histogram:
+    """
+    Count observations into buckets with fixed upper bounds, like Prometheus histograms.
+    """
+
+    def __init__(self, buckets: t.Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> t.List[t.Tuple[str, int]]:
+        """
+        Return cumulative counts per upper bound, including ``+Inf``.
+        """
+        result = []
+        total = 0
+        for bound, count in zip([*map(str, self.buckets), "+Inf"], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile, returning the upper bound of the bucket it falls into.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float("inf")
+
+
+@dataclasses.dataclass
+class ChannelMetrics:
+    """
+    Counters and histograms of a single channel.
+    """
+
+    messages_in: int = 0
+    bytes_in: int = 0
+    messages_out: int = 0
+    batches: int = 0
+    errors: int = 0
+    batch_size: Histogram = dataclasses.field(default_factory=lambda: Histogram(SIZE_BUCKETS))
+    decode_seconds: Histogram = dataclasses.field(default_factory=lambda: Histogram(LATENCY_BUCKETS))
+    sink_seconds: Histogram = dataclasses.field(default_factory=lambda: Histogram(LATENCY_BUCKETS))
+
+    def record_batch(self, batch: t.Sequence[t.Any]):
+        """
+        Account for a batch of incoming `BusMessage` objects.
+        """
+        size = 0
+        for busmsg in batch:
+            payload = busmsg.data.payload
+            if payload is not None:
+                size += len(payload)
+        self.messages_in += len(batch)
+        self.bytes_in += size
+        self.batches += 1
+        self.batch_size.observe(len(batch))
+
+    def timed_decoder(self, decoder: t.Callable) -> t.Callable:
+        """
+        Wrap a batch decoder, recording its duration.
+
+        Empty batches are not recorded, like the example batch ``Batch.map_partitions`` decodes upfront.
+        """
+
+        def decode(batch):
+            if not batch:
+                return decoder(batch)
+            started = time.perf_counter()
+            try:
+                return decoder(batch)
+            finally:
+                self.decode_seconds.observe(time.perf_counter() - started)
+
+        return decode
+
+    def timed_sink(self, sink: t.Callable) -> t.Callable:
+        """
+        Wrap a sink function, recording its duration, outgoing messages, and errors.
+        """
+
+        def write(batch):
+            started = time.perf_counter()
+            try:
+                result = sink(batch)
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.sink_seconds.observe(time.perf_counter() - started)
+            self.messages_out += len(batch)
+            return result
+
+        return write
+
+    def summary(self) -> str:
+        return (
+            f"in={self.messages_in} bytes={self.bytes_in} out={self.messages_out} "
+            f"batches={self.batches} errors={self.errors} "
+            f"decode_p99={self.decode_seconds.quantile(0.99) * 1000:g}ms "
+            f"sink_p50={self.sink_seconds.quantile(0.5) * 1000:g}ms "
+            f"sink_p99={self.sink_seconds.quantile(0.99) * 1000:g}ms"
+        )
+
+
+def render_prometheus(
+    metrics: t.Dict[str, ChannelMetrics], gauges: t.Optional[t.Dict[str, t.Dict[str, float]]] = None
+) -> str:
+    """
+    Render metrics of multiple channels in Prometheus text exposition format.
+
+    :param metrics: Metrics per channel name
+    :param gauges: Additional values per metric name and channel name, like queue depths
+    """
+    lines = []
+
+    def counter(name: str, help_: str, attribute: str):
+        lines.append(f"# HELP lorry_{name} {help_}")
+        lines.append(f"# TYPE lorry_{name} counter")
+        for channel, values in metrics.items():
+            lines.append(f'lorry_{name}{{channel="{channel}"}} {getattr(values, attribute)}')
+
+    def histogram(name: str, help_: str, attribute: str):
+        lines.append(f"# HELP lorry_{name} {help_}")
+        lines.append(f"# TYPE lorry_{name} histogram")
+        for channel, values in metrics.items():
+            hist: Histogram = getattr(values, attribute)
+            for bound, count in hist.cumulative():
+                lines.append(f'lorry_{name}_bucket{{channel="{channel}",le="{bound}"}} {count}')
+            lines.append(f'lorry_{name}_sum{{channel="{channel}"}} {hist.sum}')
+            lines.append(f'lorry_{name}_count{{channel="{channel}"}} {hist.count}')
+
+    counter("messages_in_total", "Number of messages received from the source.", "messages_in")
+    counter("bytes_in_total", "Number of payload bytes received from the source.", "bytes_in")
+    counter("messages_out_total", "Number of messages written to the sink.", "messages_out")
+    counter("batches_total", "Number of batches processed.", "batches")
+    counter("sink_errors_total", "Number of failed sink writes.", "errors")
+    histogram("batch_size", "Number of messages per batch.", "batch_size")
+    histogram("decode_seconds", "Duration of decoding a batch.", "decode_seconds")
+    histogram("sink_seconds", "Duration of writing a batch to the sink.", "sink_seconds")
+
+    for name, values in (gauges or {}).items():
+        lines.append(f"# TYPE lorry_{name} gauge")
+        for channel, value in values.items():
+            lines.append(f'lorry_{name}{{channel="{channel}"}} {value}')
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serve metrics in Prometheus text exposition format on ``/metrics``, on a background thread.
+
+    :param render: Function returning the response body
+    """
+
+    def __init__(self, render: t.Callable[[], str], host: str = "0.0.0.0", port: int = 9100):  # noqa: S104
+        self.render = render
+        self.host = host
+        self.port = port
+        self.server: t.Optional[ThreadingHTTPServer] = None
+
+    def start(self):
+        render = self.render
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # noqa: A002
+                logger.debug(format, *args)
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        threading.Thread(target=self.server.serve_forever, name="lorry-metrics", daemon=True).start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -1,12 +1,14 @@
 import dataclasses
 import operator
 import typing as t
+from enum import Enum
 from urllib.parse import parse_qs, urlparse
 
 import funcy
-from streamz import Sink, Source
+from streamz import Sink, Source, Stream
 
 from lorrystream.exceptions import InvalidSinkError
+from lorrystream.metrics import ChannelMetrics
 from lorrystream.streamz.model import URL, BusMessage
 from lorrystream.util.data import asbool, split_list
 
@@ -18,11 +20,25 @@ class Channel:
     source: Source
     pipeline: t.Any
     sink: t.Union[t.Callable, Sink]
+    name: t.Optional[str] = None
+    metrics: ChannelMetrics = dataclasses.field(default_factory=ChannelMetrics)
+    batcher: t.Optional[Stream] = None
 
     def tap(self, callback: t.Callable):
         self.pipeline.stream.sink(callback)
 
 
+class ChannelState(str, Enum):
+    """
+    Lifecycle state of a channel registered with the engine.
+    """
+
+    REGISTERED = "registered"
+    RUNNING = "running"
+    STOPPED = "stopped"
+    FAILED = "failed"
+
+
 @dataclasses.dataclass
 class Packet:
     payload: t.Any
@@ -67,6 +83,43 @@ class ConnectionString:
             return None
 
 
+@dataclasses.dataclass
+class BatchPolicy:
+    """
+    Define when the micro-batching stage of a pipeline emits a batch to the sink.
+
+    A batch is flushed as soon as one of the limits is reached: ``size`` records,
+    ``bytes`` payload bytes, or ``timeout`` seconds after its first record arrived.
+    When ``adaptive`` is enabled, the effective batch size grows up to ``size_max``
+    while flushing the sink takes longer than ``timeout``, and shrinks back to
+    ``size`` once the sink catches up again.
+    """
+
+    size: int = 1_000
+    bytes: t.Optional[int] = None
+    timeout: t.Optional[float] = 0.25
+    adaptive: bool = False
+    size_max: int = 100_000
+
+    @classmethod
+    def from_options(cls, options: t.Dict[str, t.Any]) -> "BatchPolicy":
+        """
+        Derive batching policy from ``batch-*`` URI query parameters.
+        """
+        policy = cls()
+        if "batch-size" in options:
+            policy.size = options["batch-size"]
+        if "batch-bytes" in options:
+            policy.bytes = options["batch-bytes"]
+        if "batch-timeout" in options:
+            policy.timeout = options["batch-timeout"]
+        if "batch-adaptive" in options:
+            policy.adaptive = options["batch-adaptive"]
+        if "batch-size-max" in options:
+            policy.size_max = options["batch-size-max"]
+        return policy
+
+
 @dataclasses.dataclass
 class StreamAddress:
     uri: URL
@@ -83,21 +136,58 @@ class StreamAddress:
         # Separate URI query parameters used by LorryStream.
         control_option_names = [
             # General options.
+            "ack",
             "content-type",
+            "delivery",
             "reconnect",
+            # Batching options.
+            "batch-adaptive",
+            "batch-bytes",
+            "batch-size",
+            "batch-size-max",
+            "batch-timeout",
+            # Buffering options.
+            "buffer-overflow",
+            "buffer-size",
+            "buffer-spill-directory",
+            # Sink options.
+            "format",
             # AMQP options.
+            "consumers",
             "exchange",
             "exchange-type",
+            "log-interval",
+            "log-sample",
+            "prefetch-adaptive",
+            "prefetch-count",
+            "prefetch-size",
             "queue",
             "routing-key",
             "setup",
         ]
         list_options = [
+            "queue",
             "setup",
         ]
         boolean_options = [
+            "batch-adaptive",
+            "prefetch-adaptive",
             "reconnect",
         ]
+        integer_options = [
+            "batch-bytes",
+            "batch-size",
+            "batch-size-max",
+            "buffer-size",
+            "consumers",
+            "log-sample",
+            "prefetch-count",
+            "prefetch-size",
+        ]
+        float_options = [
+            "batch-timeout",
+            "log-interval",
+        ]
         options = funcy.project(uri.query_params, control_option_names)
         query_params = funcy.omit(uri.query_params, control_option_names)
         uri.query_params = query_params
@@ -110,6 +200,14 @@ class StreamAddress:
             if boolean_option in options:
                 options[boolean_option] = asbool(options[boolean_option])
 
+        for integer_option in integer_options:
+            if integer_option in options:
+                options[integer_option] = int(options[integer_option])
+
+        for float_option in float_options:
+            if float_option in options:
+                options[float_option] = float(options[float_option])
+
         return options
 
     @classmethod
@@ -121,7 +219,7 @@ class StreamAddress:
         if callable(sink):
             url = f"callable://{sink.__name__}"
         elif isinstance(sink, str):
-            url = sink
+            return cls.from_url(sink)
         else:
             raise InvalidSinkError(f"Invalid sink: {sink}")
 
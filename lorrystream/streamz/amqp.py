@@ -6,15 +6,22 @@
 
 # pylint: disable=C0111,C0103,R0205
 
+import asyncio
+import concurrent.futures
 import functools
+import itertools
 import logging
-import time
+import random
+import threading
 import typing as t
+from collections import deque
 
 import pika
+import pika.exceptions
 from pika.adapters.asyncio_connection import AsyncioConnection
 from pika.channel import Channel
 from pika.exchange_type import ExchangeType
+from pika.spec import Basic
 
 from lorrystream.model import StreamAddress
 
@@ -23,55 +30,40 @@ LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
 LOGGER = logging.getLogger(__name__)
 
 
-class AMQPAdapter:
-    """This is an example consumer that will handle unexpected interactions
-    with RabbitMQ such as channel and connection closures.
+class AMQPConnection:
+    """Maintain a connection and a channel to an AMQP broker, and declare
+    the exchange when requested per the `setup` option. This is shared by
+    the consumer and the publisher, which implement on_exchange_ready to
+    continue once the channel can be used.
 
-    If RabbitMQ closes the connection, this class will stop and indicate
-    that reconnection is necessary. You should look at the output, as
-    there are limited reasons why the connection may be closed, which
-    usually are tied to permission related issues or socket timeouts.
-
-    If the channel is closed, it will indicate a problem with one of the
-    commands that were issued and that should surface in the output as well.
+    If RabbitMQ closes the connection, reconnect is invoked. If the channel
+    is closed, it will indicate a problem with one of the commands that
+    were issued and that should surface in the output as well.
 
     """
 
-    def __init__(self, address: StreamAddress, on_message: t.Callable = None):
-        """
-        Create and maintain a connection to an AMQP broker.
-        """
-        LOGGER.info('Creating consumer')
-
+    def __init__(self, address: StreamAddress, declare: bool = True):
         self.address = address
 
-        if "queue" not in self.address.options:
-            raise ValueError("Consuming from AMQP requires a queue name")
-
-        self.queue_name = self.address.options["queue"]
         self.exchange_name = self.address.options.get("exchange", "")
         self.exchange_type = self.address.options.get("exchange-type", "direct")
         self.routing_key = self.address.options.get("routing-key")
 
         self.should_reconnect = False
-        self.was_consuming = False
+        self.declare = declare
+        self.topology_declared = False
+        self.topology_lost = False
 
         self._connection: AsyncioConnection
         self._channel: Channel
         self._closing = False
-        self._consumer_tag: str
-        self._consuming = False
-        # In production, experiment with higher prefetch values
-        # for higher consumer throughput
-        self._prefetch_count = 1_000
-
-        self.deliver_message = on_message
 
     def needs_setup(self, key: str):
         """
-        Whether the URL query parameter ``setup={exchange,queue,bind}`` was specified.
+        Whether the URL query parameter ``setup={exchange,queue,bind}`` was specified,
+        and the topology has not been declared by a previous connection yet.
         """
-        if "setup" in self.address.options:
+        if self.declare and "setup" in self.address.options:
             setup = self.address.options["setup"]
             return key in setup
         return False
@@ -92,7 +84,6 @@ class AMQPAdapter:
             on_close_callback=self.on_connection_closed)
 
     def close_connection(self):
-        self._consuming = False
         if self._connection.is_closing or self._connection.is_closed:
             LOGGER.info('Connection is closing or already closed')
         else:
@@ -194,6 +185,9 @@ class AMQPAdapter:
 
         """
         LOGGER.warning('Channel %i was closed: %s', channel, reason)
+        if isinstance(reason, pika.exceptions.ChannelClosedByBroker) and reason.reply_code == 404:
+            # The exchange or queue vanished, so declare it again when reconnecting.
+            self.topology_lost = True
         self.close_connection()
 
     def setup_exchange(self):
@@ -212,7 +206,7 @@ class AMQPAdapter:
                 exchange_type=ExchangeType(self.exchange_type),
                 callback=cb)
         else:
-            self.setup_queue()
+            self.on_exchange_ready()
 
     def on_exchange_declareok(self, _unused_frame, userdata):
         """Invoked by pika when RabbitMQ has finished the Exchange.Declare RPC
@@ -223,6 +217,98 @@ class AMQPAdapter:
 
         """
         LOGGER.info('Exchange declared: %s', userdata)
+        self.on_exchange_ready()
+
+    def on_exchange_ready(self):
+        """Invoked when the exchange has been declared, or does not need to
+        be declared. Subclasses continue setting up the channel from here.
+
+        """
+        raise NotImplementedError
+
+    def run(self):
+        """Connect to RabbitMQ and then start the IOLoop to block and allow
+        the AsyncioConnection to operate.
+
+        """
+        self._connection = self.connect()
+        self._connection.ioloop.run_forever()
+
+
+class AMQPAdapter(AMQPConnection):
+    """This is an example consumer that will handle unexpected interactions
+    with RabbitMQ such as channel and connection closures.
+
+    If RabbitMQ closes the connection, this class will stop and indicate
+    that reconnection is necessary. You should look at the output, as
+    there are limited reasons why the connection may be closed, which
+    usually are tied to permission related issues or socket timeouts.
+
+    If the channel is closed, it will indicate a problem with one of the
+    commands that were issued and that should surface in the output as well.
+
+    """
+
+    def __init__(self, address: StreamAddress, on_message: t.Callable = None, queue: str = None, declare: bool = True):
+        """
+        Create and maintain a connection to an AMQP broker.
+
+        When the address lists multiple queues, `queue` selects the one to consume from.
+        With `declare=False`, the topology requested per `setup` is not declared again.
+        """
+        LOGGER.info('Creating consumer')
+
+        super().__init__(address, declare=declare)
+
+        if not self.address.options.get("queue"):
+            raise ValueError("Consuming from AMQP requires a queue name")
+
+        queues = self.address.options["queue"]
+        self.queue_name = queue or queues[0]
+
+        # With `ack=message`, acknowledge each message as soon as it has been
+        # handed over to the pipeline. With `ack=batch`, the pipeline
+        # acknowledges all messages of a batch at once, per
+        # `acknowledge_messages`, after the sink has written them.
+        self.ack_mode = self.address.options.get("ack", "message")
+        if self.ack_mode not in ["message", "batch"]:
+            raise ValueError(f"Invalid acknowledgement mode: {self.ack_mode}")
+
+        # Log lines about single messages are only emitted at debug level, or
+        # for every `log-sample`-th message. Instead, the number of consumed
+        # messages and acknowledgements is logged every `log-interval` seconds.
+        self.log_sample = int(self.address.options.get("log-sample", 0))
+        self.log_interval = float(self.address.options.get("log-interval", 60.0))
+        self.received_count = 0
+        self.acknowledged_count = 0
+
+        self.was_consuming = False
+
+        self._consumer_tag: str
+        self._consuming = False
+        self._paused = False
+        # The prefetch count limits the number of unacknowledged messages
+        # the broker delivers. The prefetch size limits their total size in
+        # bytes, but is not implemented by RabbitMQ. Zero means no limit.
+        self._prefetch_count = int(self.address.options.get("prefetch-count", 1_000))
+        self._prefetch_size = int(self.address.options.get("prefetch-size", 0))
+        self._last_delivery_tag = 0
+        self._last_acknowledged_tag = 0
+        # Do not let the broker deliver more messages than the buffer
+        # between consumer threads and pipeline can take, sharing it
+        # between all consumers of the source.
+        if "buffer-size" in self.address.options:
+            consumer_count = int(self.address.options.get("consumers", 1)) * len(queues)
+            buffer_share = max(int(self.address.options["buffer-size"]) // consumer_count, 1)
+            self._prefetch_count = min(self._prefetch_count, buffer_share)
+
+        self.deliver_message = on_message
+
+    def close_connection(self):
+        self._consuming = False
+        super().close_connection()
+
+    def on_exchange_ready(self):
         self.setup_queue()
 
     def setup_queue(self):
@@ -288,19 +374,49 @@ class AMQPAdapter:
         Actually start consuming messages, after setting the prefetch size for this channel.
         """
         LOGGER.info('Subscribing')
+        self.topology_declared = True
         self.set_qos()
 
     def set_qos(self):
-        """This method sets up the consumer prefetch to only be delivered
-        one message at a time. The consumer must acknowledge this message
-        before RabbitMQ will deliver another one. You should experiment
-        with different prefetch values to achieve desired performance.
+        """This method sets up the consumer prefetch window, per the
+        `prefetch-count` and `prefetch-size` options. The broker does not
+        deliver more messages until the consumer acknowledged some of them.
 
         """
         LOGGER.info('Setting QOS to: %d', self._prefetch_count)
         self._channel.basic_qos(
+            prefetch_size=self._prefetch_size,
             prefetch_count=self._prefetch_count, callback=self.on_basic_qos_ok)
 
+    @property
+    def prefetch_count(self):
+        return self._prefetch_count
+
+    def set_prefetch_count(self, prefetch_count):
+        """Change the prefetch count while consuming, by sending another
+        Basic.QoS RPC command. This method can be called from any thread.
+
+        :param int prefetch_count: The new prefetch count
+
+        """
+        if prefetch_count == self._prefetch_count:
+            return
+        LOGGER.debug('Changing QOS from %d to %d', self._prefetch_count, prefetch_count)
+        self._prefetch_count = prefetch_count
+        channel = getattr(self, '_channel', None)
+        if channel is not None and self._consuming:
+            self._call_threadsafe(
+                channel, channel.basic_qos,
+                prefetch_size=self._prefetch_size, prefetch_count=prefetch_count)
+
+    @property
+    def unacknowledged_count(self):
+        """The number of messages delivered on the current channel, which
+        have not been acknowledged yet.
+
+        """
+        return self._last_delivery_tag - self._last_acknowledged_tag
+
     def on_basic_qos_ok(self, _unused_frame):
         """Invoked by pika when the Basic.QoS method has completed. At this
         point, we will start consuming messages.
@@ -329,6 +445,20 @@ class AMQPAdapter:
         self._consumer_tag = self._channel.basic_consume(
             self.queue_name, self.on_message)
         self._consuming = True
+        if self.log_interval:
+            self._connection.ioloop.call_later(self.log_interval, self.log_counters)
+
+    def log_counters(self):
+        """Log the number of messages consumed and acknowledgements sent
+        since the last invocation, and schedule the next one.
+
+        """
+        LOGGER.info('Consumed %d messages, sent %d acknowledgements in the last %g seconds',
+                    self.received_count, self.acknowledged_count, self.log_interval)
+        self.received_count = 0
+        self.acknowledged_count = 0
+        if self._consuming and not self._closing:
+            self._connection.ioloop.call_later(self.log_interval, self.log_counters)
 
     def add_on_cancel_callback(self):
         """Add a callback that will be invoked if RabbitMQ cancels the consumer
@@ -366,11 +496,22 @@ class AMQPAdapter:
 
         """
         self.was_consuming = True
-        LOGGER.info('Received message # %s from %s: %s',
-                    basic_deliver.delivery_tag, properties.app_id, body)
+        self.received_count += 1
+        self._last_delivery_tag = basic_deliver.delivery_tag
+        if self.log_sample and self.received_count % self.log_sample == 0:
+            LOGGER.info('Received message # %s from %s: %s',
+                        basic_deliver.delivery_tag, properties.app_id, body)
+        else:
+            LOGGER.debug('Received message # %s from %s: %s',
+                         basic_deliver.delivery_tag, properties.app_id, body)
+        if self._paused:
+            # Let RabbitMQ redeliver messages which were in flight while pausing.
+            self._channel.basic_nack(basic_deliver.delivery_tag, requeue=True)
+            return
         if self.deliver_message:
             self.deliver_message(_unused_channel, basic_deliver, properties, body)
-        self.acknowledge_message(basic_deliver.delivery_tag)
+        if self.ack_mode == "message":
+            self.acknowledge_message(basic_deliver.delivery_tag)
 
     def acknowledge_message(self, delivery_tag):
         """Acknowledge the message delivery from RabbitMQ by sending a
@@ -379,8 +520,70 @@ class AMQPAdapter:
         :param int delivery_tag: The delivery tag from the Basic.Deliver frame
 
         """
-        LOGGER.info('Acknowledging message %s', delivery_tag)
+        LOGGER.debug('Acknowledging message %s', delivery_tag)
         self._channel.basic_ack(delivery_tag)
+        self.acknowledged_count += 1
+        self._last_acknowledged_tag = delivery_tag
+
+    def acknowledge_messages(self, channel, delivery_tag):
+        """Acknowledge all messages up to and including the given delivery
+        tag, by sending a single Basic.Ack RPC method with `multiple=True`.
+
+        This method can be called from any thread. Messages delivered on a
+        channel which has been closed in the meanwhile are not acknowledged,
+        because RabbitMQ redelivers them anyway.
+
+        :param pika.channel.Channel channel: The channel the messages were delivered on
+        :param int delivery_tag: The delivery tag of the last message
+
+        """
+        LOGGER.debug('Acknowledging messages up to %s', delivery_tag)
+        self._call_threadsafe(channel, self._acknowledge_multiple, channel, delivery_tag)
+
+    def _acknowledge_multiple(self, channel, delivery_tag):
+        channel.basic_ack(delivery_tag, multiple=True)
+        self.acknowledged_count += 1
+        self._last_acknowledged_tag = delivery_tag
+
+    def reject_messages(self, channel, delivery_tag):
+        """Reject all messages up to and including the given delivery tag,
+        by sending a single Basic.Nack RPC method with `multiple=True`, so
+        RabbitMQ redelivers them. This method can be called from any thread.
+
+        :param pika.channel.Channel channel: The channel the messages were delivered on
+        :param int delivery_tag: The delivery tag of the last message
+
+        """
+        LOGGER.warning('Rejecting messages up to %s', delivery_tag)
+        self._call_threadsafe(channel, channel.basic_nack, delivery_tag, multiple=True, requeue=True)
+
+    def has_channel(self, channel):
+        """Whether the given channel is the channel this consumer is
+        currently consuming from.
+
+        :param pika.channel.Channel channel: The channel
+
+        """
+        return channel is not None and channel is getattr(self, '_channel', None)
+
+    def _call_threadsafe(self, channel, method, *args, **kwargs):
+        current = getattr(self, '_channel', None)
+        if current is None or channel is not current or not current.is_open:
+            LOGGER.info('Channel has been closed, skipping %s', method.__name__)
+            return
+        self._connection.ioloop.call_soon_threadsafe(functools.partial(method, *args, **kwargs))
+
+    def pause(self):
+        """Stop consuming messages, but keep the channel open, in order to
+        acknowledge the messages which are still being processed. This
+        method can be called from any thread.
+
+        """
+        if self._consuming and not self._paused:
+            LOGGER.info('Pausing consumer')
+            self._paused = True
+            self._connection.ioloop.call_soon_threadsafe(
+                self._channel.basic_cancel, self._consumer_tag)
 
     def stop_consuming(self):
         """Tell RabbitMQ that you would like to stop consuming by sending the
@@ -423,8 +626,7 @@ class AMQPAdapter:
 
         """
         LOGGER.info('Starting consumer')
-        self._connection = self.connect()
-        self._connection.ioloop.run_forever()
+        super().run()
 
     def stop(self):
         """Cleanly shutdown the connection to RabbitMQ by stopping the consumer
@@ -439,6 +641,9 @@ class AMQPAdapter:
         """
         if not self._closing:
             self._closing = True
+            if not hasattr(self, '_connection'):
+                # Stopped before connecting.
+                return
             LOGGER.info('Stopping consumer')
             if self._consuming:
                 self.stop_consuming()
@@ -454,19 +659,32 @@ class ReconnectingAMQPAdapter:
     """This is an example consumer that will reconnect if the nested
     AMQPAdapter indicates that a reconnect is necessary.
 
+    The first reconnect attempt happens immediately. Subsequent ones are
+    delayed using exponential backoff with full jitter, so many consumers
+    do not reconnect in lockstep after a broker failover. The topology
+    requested per `setup` is only declared by the first connection.
+
     """
 
-    def __init__(self, address: StreamAddress, on_message: t.Callable = None):
+    RECONNECT_DELAY_BASE = 0.5
+    RECONNECT_DELAY_MAX = 30.0
+
+    def __init__(self, address: StreamAddress, on_message: t.Callable = None, queue: str = None):
         self.address = address
-        self._reconnect_delay = 0
+        self._reconnect_attempt = 0
         self._on_message = on_message
+        self._queue = queue
+        self._topology_declared = False
+        self._stopped = threading.Event()
         self._consumer = self.consumer_factory()
 
     def consumer_factory(self):
-        return AMQPAdapter(address=self.address, on_message=self._on_message)
+        return AMQPAdapter(
+            address=self.address, on_message=self._on_message, queue=self._queue,
+            declare=not self._topology_declared)
 
     def run(self):
-        while True:
+        while not self._stopped.is_set():
             try:
                 self._consumer.run()
             except KeyboardInterrupt:
@@ -475,24 +693,289 @@ class ReconnectingAMQPAdapter:
             self._maybe_reconnect()
 
     def stop(self):
+        self._stopped.set()
         self._consumer.stop()
 
+    def pause(self):
+        self._consumer.pause()
+
+    def acknowledge_messages(self, channel, delivery_tag):
+        self._consumer.acknowledge_messages(channel, delivery_tag)
+
+    def reject_messages(self, channel, delivery_tag):
+        self._consumer.reject_messages(channel, delivery_tag)
+
+    def has_channel(self, channel):
+        return self._consumer.has_channel(channel)
+
+    @property
+    def prefetch_count(self):
+        return self._consumer.prefetch_count
+
+    def set_prefetch_count(self, prefetch_count):
+        self._consumer.set_prefetch_count(prefetch_count)
+
+    @property
+    def unacknowledged_count(self):
+        return self._consumer.unacknowledged_count
+
     def _maybe_reconnect(self):
-        if self._consumer.should_reconnect:
+        if self._consumer.should_reconnect and not self._stopped.is_set():
             self._consumer.stop()
+            if self._consumer.topology_lost:
+                self._topology_declared = False
+            elif self._consumer.topology_declared:
+                self._topology_declared = True
             reconnect_delay = self._get_reconnect_delay()
-            LOGGER.info('Reconnecting after %d seconds', reconnect_delay)
-            time.sleep(reconnect_delay)
+            LOGGER.info('Reconnecting after %.3f seconds', reconnect_delay)
+            # Waiting is interrupted when stopping the consumer.
+            if self._stopped.wait(reconnect_delay):
+                return
             self._consumer = self.consumer_factory()
+        else:
+            self._stopped.set()
 
     def _get_reconnect_delay(self):
         if self._consumer.was_consuming:
-            self._reconnect_delay = 0
+            self._reconnect_attempt = 0
+        attempt = self._reconnect_attempt
+        self._reconnect_attempt += 1
+        return get_reconnect_delay(attempt, self.RECONNECT_DELAY_BASE, self.RECONNECT_DELAY_MAX)
+
+
+class PublishError(Exception):
+    pass
+
+
+class PendingBatch:
+    """A batch of published messages, waiting for the broker to confirm
+    all of them.
+
+    """
+
+    __slots__ = ('future', 'count', 'remaining', 'rejected')
+
+    def __init__(self, future, count):
+        self.future = future
+        self.count = count
+        self.remaining = count
+        self.rejected = 0
+
+    def confirm(self, acked):
+        """Account for the confirmation of a single message, and resolve the
+        future when all messages of the batch have been confirmed.
+
+        :param bool acked: Whether the broker acknowledged or rejected the message
+
+        """
+        self.remaining -= 1
+        if not acked:
+            self.rejected += 1
+        if self.remaining == 0 and not self.future.done():
+            if self.rejected:
+                self.future.set_exception(
+                    PublishError('Broker rejected %d of %d messages' % (self.rejected, self.count)))
+            else:
+                self.future.set_result(self.count)
+
+    def fail(self, exception):
+        if not self.future.done():
+            self.future.set_exception(exception)
+
+
+class AMQPPublisher(AMQPConnection):
+    """Publish batches of messages to an AMQP broker, using asynchronous
+    publisher confirms.
+
+    The messages of a batch are published at once. RabbitMQ numbers the
+    messages published on a channel in confirm mode, starting at one, and
+    confirms them by sending Basic.Ack or Basic.Nack frames, which may cover
+    all messages up to a given delivery tag. Instead of waiting for the
+    confirmation of each message, the publisher tracks the pending batch
+    of each delivery tag, and resolves the future of a batch when all of
+    its messages have been confirmed.
+
+    The publisher runs its own IOLoop on a dedicated thread, see start.
+    Batches published before the channel is ready are held back. When the
+    connection is lost, unconfirmed batches fail, and the publisher
+    reconnects using exponential backoff with full jitter.
+
+    """
+
+    RECONNECT_DELAY_BASE = 0.5
+    RECONNECT_DELAY_MAX = 30.0
+
+    def __init__(self, address: StreamAddress):
+        LOGGER.info('Creating publisher')
+        super().__init__(address)
+        # Without a routing key, publish to the first queue, which works
+        # with the default exchange.
+        if self.routing_key is None:
+            queues = self.address.options.get("queue") or [""]
+            self.routing_key = queues[0]
+        self.loop = asyncio.new_event_loop()
+        self._thread: t.Optional[threading.Thread] = None
+        self._ready = False
+        self._backlog: t.Deque[t.Tuple[t.List[t.Tuple[bytes, pika.BasicProperties]], PendingBatch]] = deque()
+        self._unconfirmed: t.Dict[int, PendingBatch] = {}
+        self._message_number = 0
+        self._reconnect_attempt = 0
+
+    def start(self):
+        """Connect to RabbitMQ on a dedicated daemon thread.
+
+        """
+        self._thread = threading.Thread(target=self.run, name='lorry-amqp-publisher', daemon=True)
+        self._thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        LOGGER.info('Starting publisher')
+        super().run()
+
+    def on_exchange_ready(self):
+        """Enable publisher confirms by issuing the Confirm.Select RPC
+        command. RabbitMQ will invoke on_delivery_confirmation for the
+        messages published afterwards.
+
+        """
+        LOGGER.info('Enabling publisher confirms')
+        self.topology_declared = True
+        self._message_number = 0
+        self._channel.confirm_delivery(self.on_delivery_confirmation, callback=self.on_confirm_selectok)
+
+    def on_confirm_selectok(self, _unused_frame):
+        """Invoked by pika when RabbitMQ has enabled publisher confirms. At
+        this point, publish the batches which have been held back.
+
+        :param pika.frame.Method _unused_frame: The Confirm.SelectOk response frame
+
+        """
+        LOGGER.info('Publisher confirms enabled')
+        self._ready = True
+        self._reconnect_attempt = 0
+        while self._backlog and self._ready:
+            self._publish(*self._backlog.popleft())
+
+    def publish(self, messages):
+        """Publish a batch of messages. This method can be called from any
+        thread. Return a concurrent.futures.Future, which resolves to the
+        number of messages when RabbitMQ confirmed all of them, or fails
+        with PublishError when it rejected any of them.
+
+        :param list messages: Pairs of message body and pika.BasicProperties
+
+        """
+        future = concurrent.futures.Future()
+        pending = PendingBatch(future, len(messages))
+        if not messages:
+            future.set_result(0)
+        elif self._closing:
+            pending.fail(PublishError('Publisher has been stopped'))
+        else:
+            self.loop.call_soon_threadsafe(self._publish, messages, pending)
+        return future
+
+    def _publish(self, messages, pending):
+        if not self._ready:
+            self._backlog.append((messages, pending))
+            return
+        try:
+            for body, properties in messages:
+                self._channel.basic_publish(self.exchange_name, self.routing_key, body, properties)
+                self._message_number += 1
+                self._unconfirmed[self._message_number] = pending
+        except Exception as ex:
+            LOGGER.error('Publishing failed: %s', ex)
+            pending.fail(ex)
+
+    def on_delivery_confirmation(self, method_frame):
+        """Invoked by pika when RabbitMQ responds to a Basic.Publish RPC
+        command, passing in either a Basic.Ack or Basic.Nack frame with
+        the delivery tag of the message that was published. With the
+        multiple flag, all messages up to the delivery tag are confirmed.
+
+        :param pika.frame.Method method_frame: Basic.Ack or Basic.Nack frame
+
+        """
+        confirmation = method_frame.method
+        acked = isinstance(confirmation, Basic.Ack)
+        delivery_tag = confirmation.delivery_tag
+        if confirmation.multiple:
+            # Delivery tags are ascending, in order of insertion.
+            delivery_tags = list(itertools.takewhile(lambda tag: tag <= delivery_tag, self._unconfirmed))
+        else:
+            delivery_tags = [delivery_tag]
+        if not acked:
+            LOGGER.warning('Broker rejected messages up to %s', delivery_tag)
+        for tag in delivery_tags:
+            pending = self._unconfirmed.pop(tag, None)
+            if pending is not None:
+                pending.confirm(acked)
+
+    def _fail_unconfirmed(self, exception):
+        for pending in self._unconfirmed.values():
+            pending.fail(exception)
+        self._unconfirmed.clear()
+
+    def reconnect(self):
+        """Will be invoked if the connection can't be opened or is closed.
+        Fail the unconfirmed batches, because their confirmations will not
+        arrive on another channel, and connect again after a delay.
+
+        """
+        self._ready = False
+        self._fail_unconfirmed(PublishError('Connection to broker has been lost'))
+        if self._closing:
+            self.loop.stop()
+            return
+        delay = get_reconnect_delay(self._reconnect_attempt, self.RECONNECT_DELAY_BASE, self.RECONNECT_DELAY_MAX)
+        self._reconnect_attempt += 1
+        LOGGER.info('Reconnecting after %.3f seconds', delay)
+        self.loop.call_later(delay, self._reopen)
+
+    def _reopen(self):
+        if not self._closing:
+            self._connection = self.connect()
+
+    def stop(self):
+        """Close the connection to RabbitMQ, and stop the IOLoop. Batches
+        which have not been confirmed yet fail. This method can be called
+        from any thread.
+
+        """
+        if self._closing:
+            return
+        self._closing = True
+        if self._thread is None:
+            # Stopped before starting.
+            return
+        LOGGER.info('Stopping publisher')
+        self.loop.call_soon_threadsafe(self._shutdown)
+
+    def _shutdown(self):
+        self._ready = False
+        exception = PublishError('Publisher has been stopped')
+        while self._backlog:
+            self._backlog.popleft()[1].fail(exception)
+        self._fail_unconfirmed(exception)
+        connection = getattr(self, '_connection', None)
+        if connection is None or connection.is_closed:
+            self.loop.stop()
         else:
-            self._reconnect_delay += 1
-        if self._reconnect_delay > 30:
-            self._reconnect_delay = 30
-        return self._reconnect_delay
+            self.close_connection()
+
+
+def get_reconnect_delay(attempt, base, maximum):
+    """Compute the delay before the given reconnect attempt, counting from
+    zero. The first attempt happens immediately, subsequent ones use
+    exponential backoff with full jitter.
+
+    """
+    if attempt == 0:
+        return 0.0
+    ceiling = min(maximum, base * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)  # noqa: S311
 
 
 def main():
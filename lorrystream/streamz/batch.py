@@ -0,0 +1,148 @@
+import logging
+import time
+import typing as t
+
+from streamz import Stream
+from tornado import gen
+
+from lorrystream.model import BatchPolicy
+
+logger = logging.getLogger(__name__)
+
+
+def payload_size(x: t.Any) -> int:
+    """
+    Estimate the size of a pipeline element in bytes, for enforcing ``BatchPolicy.bytes``.
+    """
+    data = getattr(x, "data", None)
+    if data is not None:
+        x = data.payload
+    if isinstance(x, (bytes, bytearray, str)):
+        return len(x)
+    return 0
+
+
+@Stream.register_api()
+class micro_batch(Stream):
+    """
+    Partition stream into batches, according to a ``BatchPolicy``.
+
+    Other than ``streamz.partition``, a batch is emitted when it reaches a
+    maximum number of elements, a maximum number of payload bytes, or when
+    the linger time has elapsed, whatever comes first.
+
+    With ``policy.adaptive``, the effective batch size doubles each time
+    emitting a full batch downstream takes longer than the linger time,
+    i.e. when the sink falls behind, up to ``policy.size_max``. It is
+    halved again, down to ``policy.size``, when the sink catches up.
+
+    :param policy: BatchPolicy
+    :param sizeof: callable
+        Function to compute the size of an element in bytes.
+    """
+
+    _graphviz_shape = "diamond"
+
+    def __init__(self, upstream, policy: BatchPolicy, sizeof: t.Callable = None, **kwargs):
+        self.policy = policy
+        self.sizeof = sizeof or payload_size
+        self.n = policy.size
+        self._buffer: t.List[t.Any] = []
+        self._metadata_buffer: t.List[t.Dict] = []
+        self._nbytes = 0
+        self._callback = None
+        kwargs["ensure_io_loop"] = True
+        Stream.__init__(self, upstream, **kwargs)
+
+    @gen.coroutine
+    def update(self, x, who=None, metadata=None):
+        self._retain_refs(metadata)
+        self._buffer.append(x)
+        if isinstance(metadata, list):
+            self._metadata_buffer.extend(metadata)
+        else:
+            self._metadata_buffer.append(metadata)
+        if self.policy.bytes is not None:
+            self._nbytes += self.sizeof(x)
+        if len(self._buffer) >= self.n or (self.policy.bytes is not None and self._nbytes >= self.policy.bytes):
+            yield self.flush()
+            return
+        if len(self._buffer) == 1 and self.policy.timeout is not None:
+            self._callback = self.loop.call_later(self.policy.timeout, self.flush)
+
+    @gen.coroutine
+    def flush(self):
+        """
+        Emit all buffered elements downstream.
+        """
+        if self._callback is not None:
+            self.loop.remove_timeout(self._callback)
+            self._callback = None
+        if not self._buffer:
+            return
+        result, self._buffer = self._buffer, []
+        metadata_result, self._metadata_buffer = self._metadata_buffer, []
+        self._nbytes = 0
+        started = time.perf_counter()
+        yield self._emit(tuple(result), list(metadata_result))
+        self._release_refs(metadata_result)
+        if self.policy.adaptive:
+            self._adapt(len(result), time.perf_counter() - started)
+
+    def _adapt(self, count: int, duration: float):
+        """
+        Grow the batch size when the sink falls behind, shrink it when it caught up.
+        """
+        linger = self.policy.timeout or 0
+        n = self.n
+        if count >= self.n and duration > linger:
+            n = min(self.n * 2, self.policy.size_max)
+        elif duration < linger / 4:
+            n = max(self.n // 2, self.policy.size)
+        if n != self.n:
+            logger.debug(f"Adjusting batch size from {self.n} to {n}")
+            self.n = n
+
+
+@Stream.register_api()
+class acknowledge(Stream):
+    """
+    Acknowledge batches to their source, after all downstream nodes processed them.
+
+    With synchronous sinks, this means the sink has written the batch. With
+    asynchronous sinks, returning futures, it is acknowledged when they are
+    resolved. When a downstream node fails, the batch is rejected instead,
+    and the error is propagated.
+
+    :param ack: callable
+        Function to acknowledge a batch.
+    :param reject: callable
+        Function to reject a batch.
+    """
+
+    def __init__(self, upstream, ack: t.Callable, reject: t.Optional[t.Callable] = None, **kwargs):
+        self.ack = ack
+        self.reject = reject
+        Stream.__init__(self, upstream, **kwargs)
+
+    def update(self, x, who=None, metadata=None):
+        try:
+            result = self._emit(x, metadata=metadata)
+        except Exception:
+            if self.reject is not None:
+                self.reject(x)
+            raise
+        if not result:
+            self.ack(x)
+            return result
+        return self._settle(x, result)
+
+    @gen.coroutine
+    def _settle(self, x, futures):
+        try:
+            yield futures
+        except Exception:
+            if self.reject is not None:
+                self.reject(x)
+            raise
+        self.ack(x)
@@ -0,0 +1,156 @@
+import logging
+import os
+import pickle
+import queue
+import struct
+import tempfile
+import typing as t
+from collections import deque
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+
+class OverflowPolicy(str, Enum):
+    """
+    What to do when a message arrives while the buffer is full.
+    """
+
+    BLOCK = "block"
+    DROP_OLDEST = "drop-oldest"
+    SPILL = "spill"
+
+
+class SpillFile:
+    """
+    A FIFO of pickled items, stored in a temporary file on disk.
+
+    Items referencing objects which can not be pickled, like connection handles,
+    need to be converted by ``encode`` and ``decode`` functions.
+    """
+
+    HEADER = struct.Struct("!I")
+
+    def __init__(self, directory: t.Optional[str] = None, encode: t.Callable = None, decode: t.Callable = None):
+        self.file = tempfile.TemporaryFile(prefix="lorrystream-spill-", dir=directory)  # noqa: SIM115
+        self.encode = encode
+        self.decode = decode
+        self.read_position = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, item: t.Any):
+        if self.encode is not None:
+            item = self.encode(item)
+        data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(self.HEADER.pack(len(data)))
+        self.file.write(data)
+        self.count += 1
+
+    def popleft(self) -> t.Any:
+        if not self.count:
+            raise IndexError("pop from an empty spill file")
+        self.file.seek(self.read_position)
+        (size,) = self.HEADER.unpack(self.file.read(self.HEADER.size))
+        item = pickle.loads(self.file.read(size))  # noqa: S301
+        if self.decode is not None:
+            item = self.decode(item)
+        self.read_position = self.file.tell()
+        self.count -= 1
+        # Reclaim disk space when the spill file has been drained.
+        if not self.count:
+            self.file.seek(0)
+            self.file.truncate()
+            self.read_position = 0
+        return item
+
+    def close(self):
+        self.file.close()
+
+
+class BoundedBuffer(queue.Queue):
+    """
+    A thread-safe queue between broker client threads and the streamz pipeline,
+    holding at most ``maxsize`` items in memory.
+
+    When the buffer is full, the ``overflow`` policy decides what happens:
+
+    - ``block``: Block the broker client thread until there is room again.
+    - ``drop-oldest``: Discard the oldest item in the buffer.
+    - ``spill``: Store new items in a temporary file on disk, until there is room again.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10_000,
+        overflow: t.Union[OverflowPolicy, str] = OverflowPolicy.BLOCK,
+        spill_directory: t.Optional[str] = None,
+        spill_encode: t.Callable = None,
+        spill_decode: t.Callable = None,
+    ):
+        if maxsize < 1:
+            raise ValueError("Buffer size must be at least 1")
+        self.overflow = OverflowPolicy(overflow)
+        self.limit = maxsize
+        self.spill_directory = spill_directory
+        self.spill_encode = spill_encode
+        self.spill_decode = spill_decode
+        self.spill: t.Optional[SpillFile] = None
+        self.dropped = 0
+        self.spilled = 0
+        # Only the `block` policy uses the blocking semantics of the standard queue.
+        super().__init__(maxsize=maxsize if self.overflow is OverflowPolicy.BLOCK else 0)
+
+    @classmethod
+    def from_options(cls, options: t.Dict[str, t.Any], **kwargs) -> "BoundedBuffer":
+        """
+        Create buffer from ``buffer-*`` URI query parameters.
+        """
+        return cls(
+            maxsize=options.get("buffer-size", 10_000),
+            overflow=options.get("buffer-overflow", OverflowPolicy.BLOCK),
+            spill_directory=options.get("buffer-spill-directory"),
+            **kwargs,
+        )
+
+    @property
+    def depth(self) -> int:
+        """
+        Number of items waiting in the buffer, including spilled ones.
+        """
+        return self.qsize()
+
+    def _init(self, maxsize):
+        self.queue: t.Deque[t.Any] = deque()
+
+    def _qsize(self):
+        return len(self.queue) + len(self.spill or ())
+
+    def _put(self, item):
+        if self.overflow is OverflowPolicy.DROP_OLDEST and len(self.queue) >= self.limit:
+            self.queue.popleft()
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 10_000 == 0:
+                logger.warning(f"Buffer full, dropped {self.dropped} messages so far")
+        elif self.overflow is OverflowPolicy.SPILL and (len(self.queue) >= self.limit or self.spill):
+            # Once spilling started, keep appending to the spill file to retain the order of items.
+            if self.spill is None:
+                self.spill = SpillFile(
+                    directory=self.spill_directory, encode=self.spill_encode, decode=self.spill_decode
+                )
+                logger.warning("Buffer full, spilling messages to disk")
+            self.spill.append(item)
+            self.spilled += 1
+            return
+        self.queue.append(item)
+
+    def _get(self):
+        if not self.queue and self.spill:
+            self.queue.append(self.spill.popleft())
+        item = self.queue.popleft()
+        while self.spill and len(self.queue) < self.limit:
+            self.queue.append(self.spill.popleft())
+        return item
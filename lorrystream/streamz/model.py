@@ -112,6 +112,22 @@ class BusMessage:
             ),
         )
 
+    def detach(self) -> BusMessageData:
+        """
+        Return message data without references to connection objects, e.g. for spilling it to disk.
+        """
+        meta = self.data.meta
+        if isinstance(meta, dict) and "info" in meta:
+            meta = OrderedDict((key, value) for key, value in meta.items() if key != "info")
+        return BusMessageData(meta=meta, headers=self.data.headers, payload=self.data.payload)
+
+    @classmethod
+    def attach(cls, data: BusMessageData, stream: Stream) -> "BusMessage":
+        """
+        Reconstruct a `BusMessage` instance from detached message data.
+        """
+        return cls(connection=BusMessageConnection(stream=stream), data=data)
+
     @staticmethod
     def _pika_delivery_to_dict(basic_deliver) -> t.Dict:
         deliver_slots = ["consumer_tag", "delivery_tag", "redelivered", "exchange", "routing_key"]
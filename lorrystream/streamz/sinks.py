@@ -1,70 +1,123 @@
 # Copyright (c) 2013-2023, The Kotori developers and contributors.
 # Distributed under the terms of a BSD-3-Clause license, see LICENSE.
 
+import asyncio
 import logging
 import re
+import time
 import typing as t
 
+import orjson
 import pandas as pd
+import pika
 import sqlalchemy as sa
 from sqlalchemy.engine import Engine
 from streamz import Sink, Stream
+from tornado import gen
 
 from lorrystream.exceptions import InvalidSinkError
+from lorrystream.metrics import ChannelMetrics
+from lorrystream.model import StreamAddress
+from lorrystream.streamz.amqp import AMQPPublisher
 
 logger = logging.getLogger(__name__)
 
 
-@Stream.register_api()
-class dataframe_to_sql(Sink):
+class SQLSink(Sink):
     """
-    Store data into SQLAlchemy-compatible database.
+    Common connection handling of sinks storing data into SQLAlchemy-compatible databases.
 
-    Requires ``sqlalchemy``
+    Subclasses implement ``write``, which is timed into ``metrics``, when given.
 
     :param dburi: str
         SQLAlchemy connection URI.
     :param engine_options:
         Propagated to SQLAlchemy's ``create_engine(**kwargs)``.
+    :param metrics: ChannelMetrics
+        Record write latencies, outgoing messages, and errors.
     """
 
-    def __init__(self, upstream, dburi, engine_options=None, **kwargs):
+    def __init__(self, upstream, dburi, engine_options=None, metrics: t.Optional[ChannelMetrics] = None, **kwargs):
         self.dburi = dburi
+        self._write = metrics.timed_sink(self.write) if metrics is not None else self.write
         self.engine: t.Union[Engine, None] = None
         self.engine_options = engine_options or {}
-        self.table_name = None
+        self.table_name: str = ""
         self.if_exists = "append"
-        self.method = None
-        self.chunksize = 10_000
         super().__init__(upstream, ensure_io_loop=True, **kwargs)
 
+    def connect(self):
+        logger.info(f"Connecting to {self.dburi}")
+        # TODO: Improve.
+        matches = re.match(r"^.*table=([\w-]*)", self.dburi)
+        if matches:
+            self.table_name = matches.group(1)
+        else:
+            raise InvalidSinkError("Unable to obtain table name")
+        matches = re.match(r"^.*if_exists=(\w*)", self.dburi)
+        if matches:
+            self.if_exists = matches.group(1)
+        dburi = re.sub(r"\?.*", "", self.dburi)
+        logger.info(f"Effective dburi: {dburi}")
+        logger.info(f"Writing to table: {self.table_name}, if_exists={self.if_exists}")
+        self.engine = sa.create_engine(dburi, **self.engine_options)
+
     def update(self, x, who=None, metadata=None):
+        self._write(x)
+
+    def write(self, x):
+        raise NotImplementedError
+
+    @property
+    def is_cratedb(self) -> bool:
+        return self.dburi.startswith("crate")
+
+    def close(self):
+        """
+        Disconnect from the database. The next write will connect again.
+        """
+        if self.engine is not None:
+            logger.info(f"Disconnecting from {self.dburi}")
+            self.engine.dispose()
+            self.engine = None
+
+    def destroy(self):
+        self.close()
+        super().destroy()
+
+
+@Stream.register_api()
+class dataframe_to_sql(SQLSink):
+    """
+    Store data into SQLAlchemy-compatible database.
+
+    Requires ``sqlalchemy``
+
+    :param dburi: str
+        SQLAlchemy connection URI.
+    :param engine_options:
+        Propagated to SQLAlchemy's ``create_engine(**kwargs)``.
+    """
+
+    def __init__(self, upstream, dburi, **kwargs):
+        self.method = None
+        self.chunksize = 10_000
+        super().__init__(upstream, dburi, **kwargs)
+
+    def write(self, x):
         """
         Store packets into database.
         """
         df: pd.DataFrame = x
-        logger.info(f"to_sql.update: who={who}, metadata={metadata}")
+        logger.info(f"to_sql.write: records={len(df)}")
         df.info()
         print(df)  # noqa: T201
 
         if self.engine is None:
-            logger.info(f"Connecting to {self.dburi}")
-            # TODO: Improve.
-            matches = re.match(r"^.*table=([\w-]*)", self.dburi)
-            if matches:
-                self.table_name = matches.group(1)
-            else:
-                raise InvalidSinkError("Unable to obtain table name")
-            matches = re.match(r"^.*if_exists=(\w*)", self.dburi)
-            if matches:
-                self.if_exists = matches.group(1)
-            dburi = re.sub(r"\?.*", "", self.dburi)
-            logger.info(f"Effective dburi: {dburi}")
-            logger.info(f"Writing to table: {self.table_name}, if_exists={self.if_exists}")
-            self.engine = sa.create_engine(dburi, **self.engine_options)
+            self.connect()
 
             # Use CrateDB bulk operations endpoint for improved efficiency.
-            if self.dburi.startswith("crate"):
+            if self.is_cratedb:
                 self.method = self.insert_bulk
 
         df.to_sql(
@@ -107,8 +160,152 @@ class dataframe_to_sql(Sink):
         cursor.execute(sql=sql, bulk_parameters=data)
         cursor.close()
 
+
+@Stream.register_api()
+class records_to_sql(SQLSink):
+    """
+    Store lists of records (dictionaries) into SQLAlchemy-compatible database, without using pandas.
+
+    Other than ``dataframe_to_sql``, this sink does not convert batches into
+    pandas DataFrames, which are converted back into rows by ``df.to_sql``.
+    Instead, it builds bulk parameters straight from the decoded payloads.
+
+    pandas is only used once, to infer the table schema from the first batch,
+    when the table does not exist yet. With ``if_exists=replace``, the table
+    is replaced when writing the first batch, and appended to afterwards.
+
+    Records are not converted. Values must be understood by the database driver.
+
+    Requires ``sqlalchemy``
+
+    :param dburi: str
+        SQLAlchemy connection URI.
+    :param engine_options:
+        Propagated to SQLAlchemy's ``create_engine(**kwargs)``.
+    """
+
+    def __init__(self, upstream, dburi, **kwargs):
+        self.table: t.Optional[sa.Table] = None
+        super().__init__(upstream, dburi, **kwargs)
+
+    def write(self, x):
+        """
+        Store records into database.
+        """
+        records: t.List[t.Dict[str, t.Any]] = x
+        if not records:
+            return
+
+        if self.engine is None:
+            self.connect()
+        if self.table is None:
+            self.table = self.provision_table(records)
+
+        # Collect all column names, in order of appearance.
+        columns = list(dict.fromkeys(key for record in records for key in record))
+
+        with self.engine.begin() as conn:  # type: ignore[union-attr]
+            self.insert(conn, self.table, columns, records)
+
+    def provision_table(self, records: t.List[t.Dict[str, t.Any]]) -> sa.Table:
+        """
+        Create the table from the first batch of records, if it does not exist, and reflect it.
+        """
+        engine = t.cast(Engine, self.engine)
+        if self.if_exists == "replace" or not sa.inspect(engine).has_table(self.table_name):
+            logger.info(f"Creating table: {self.table_name}")
+            pd.DataFrame.from_records(records).head(0).to_sql(
+                name=self.table_name, con=engine, if_exists=self.if_exists, index=False
+            )
+        return sa.Table(self.table_name, sa.MetaData(), autoload_with=engine)
+
+    def insert(self, conn: sa.Connection, table: sa.Table, columns: t.List[str], records: t.List[t.Dict[str, t.Any]]):
+        if self.is_cratedb:
+            # Use CrateDB bulk operations endpoint for improved efficiency.
+            compiled = table.insert().compile(dialect=conn.dialect, column_keys=columns)
+            keys = compiled.positiontup or []
+            rows = [[record.get(key) for key in keys] for record in records]
+            cursor = conn.connection.cursor()
+            cursor.execute(sql=str(compiled), bulk_parameters=rows)  # type: ignore[call-arg]
+            cursor.close()
+        else:
+            parameters = [{column: record.get(column) for column in columns} for record in records]
+            conn.execute(table.insert(), parameters)
+
+
+@Stream.register_api()
+class to_amqp(Sink):
+    """
+    Publish batches to an AMQP broker, using asynchronous publisher confirms.
+
+    The messages of a batch are published at once. ``update`` returns a future,
+    which is resolved when the broker confirmed all of them, so upstream nodes
+    wait for it, and ``ack=batch`` acknowledges the source messages only then.
+
+    Payloads which are bytes or strings are published as they are, others are
+    encoded to JSON. The exchange and routing key are taken from ``address``,
+    see ``AMQPPublisher``.
+
+    :param address: StreamAddress
+        AMQP broker URL and options.
+    :param metrics: ChannelMetrics
+        Record confirmation latencies, outgoing messages, and errors.
+    """
+
+    RAW_PROPERTIES = pika.BasicProperties(delivery_mode=pika.DeliveryMode.Persistent)
+    JSON_PROPERTIES = pika.BasicProperties(
+        content_type="application/json", delivery_mode=pika.DeliveryMode.Persistent
+    )
+
+    def __init__(self, upstream, address: StreamAddress, metrics: t.Optional[ChannelMetrics] = None, **kwargs):
+        self.address = address
+        self.metrics = metrics
+        self.publisher: t.Optional[AMQPPublisher] = None
+        super().__init__(upstream, ensure_io_loop=True, **kwargs)
+
+    def connect(self):
+        logger.info(f"Connecting to {self.address.uri}")
+        self.publisher = AMQPPublisher(self.address)
+        self.publisher.start()
+
+    def update(self, x, who=None, metadata=None):
+        if self.publisher is None:
+            self.connect()
+        messages = [self.encode(payload) for payload in x]
+        future = self.publisher.publish(messages)  # type: ignore[union-attr]
+        return self.confirm(asyncio.wrap_future(future), len(messages))
+
+    @gen.coroutine
+    def confirm(self, future, count: int):
+        started = time.perf_counter()
+        try:
+            yield future
+        except Exception:
+            if self.metrics is not None:
+                self.metrics.errors += 1
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.sink_seconds.observe(time.perf_counter() - started)
+        if self.metrics is not None:
+            self.metrics.messages_out += count
+
+    def encode(self, payload: t.Any) -> t.Tuple[bytes, pika.BasicProperties]:
+        if isinstance(payload, bytes):
+            return payload, self.RAW_PROPERTIES
+        if isinstance(payload, str):
+            return payload.encode("utf-8"), self.RAW_PROPERTIES
+        return orjson.dumps(payload), self.JSON_PROPERTIES
+
+    def close(self):
+        """
+        Disconnect from the broker. The next batch will connect again.
+        """
+        if self.publisher is not None:
+            logger.info(f"Disconnecting from {self.address.uri}")
+            self.publisher.stop()
+            self.publisher = None
+
     def destroy(self):
-        if self.engine is not None:
-            logger.info(f"Disconnecting from {self.dburi}")
-            self.engine.dispose()
+        self.close()
         super().destroy()
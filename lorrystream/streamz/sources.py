@@ -1,22 +1,112 @@
 # Copyright (c) 2013-2024, The Kotori developers and contributors.
 # Distributed under the terms of a BSD-3-Clause license, see LICENSE.
+import asyncio
+import functools
 import logging
 import queue
 import typing as t
 from collections import OrderedDict
 
 from streamz import Stream, from_mqtt, from_q
+from tornado.ioloop import PeriodicCallback
 
 from lorrystream.model import StreamAddress
 from lorrystream.streamz.amqp import AMQPAdapter, ReconnectingAMQPAdapter
+from lorrystream.streamz.buffer import BoundedBuffer
 from lorrystream.streamz.model import URL, BusMessage
 from lorrystream.util.aio import AsyncThreadTask
 
 logger = logging.getLogger(__name__)
 
 
+class AsyncDelivery:
+    """
+    Deliver messages from broker client threads into the pipeline's event loop without polling.
+
+    ``streamz.from_q`` polls its queue, and sleeps for ``sleep_time`` when it is
+    empty, adding up to 10 ms of latency to each message arriving while idle.
+    With ``delivery=async``, which is the default, the source coroutine instead
+    waits for a wakeup signal, which a broker client thread sends through the
+    event loop's thread-safe ``add_callback`` when it delivered a message while
+    the source was idle. While messages keep arriving, they are drained from the
+    buffer without any wakeups. ``delivery=poll`` restores the polling behaviour.
+    """
+
+    q: queue.Queue
+    loop: t.Any
+    stopped: bool
+
+    IDLE_TIMEOUT = 1.0
+
+    def _setup_delivery(self, options: t.Dict[str, t.Any]):
+        self.delivery = options.get("delivery", "async")
+        if self.delivery not in ["async", "poll"]:
+            raise ValueError(f"Invalid delivery mode: {self.delivery}")
+        self._waiting = False
+        self._wakeup: t.Optional[asyncio.Event] = None
+
+    def deliver(self, item: t.Any):
+        """
+        Put message into buffer, and wake up the source coroutine when it is idle.
+
+        This method is called on the broker client thread.
+        """
+        self.q.put(item)
+        if self._waiting:
+            self._waiting = False
+            self.loop.add_callback(self._notify)
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        if self.delivery == "poll":
+            return await super()._run()  # type: ignore[misc]
+        try:
+            item = self.q.get_nowait()
+        except queue.Empty:
+            await self._idle()
+            return None
+        return await self.emit(item, asynchronous=True)  # type: ignore[attr-defined]
+
+    async def _idle(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.clear()
+        # Announce waiting before checking the buffer again, so a message
+        # delivered in between will not go unnoticed.
+        self._waiting = True
+        if self.q.empty() and not self.stopped:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+        self._waiting = False
+
+    def stop(self):
+        super().stop()  # type: ignore[misc]
+        self.loop.add_callback(self._notify)
+
+    async def drain(self):
+        """
+        Stop emitting new messages, and emit all messages remaining in the buffer into the pipeline.
+        """
+        self.stopped = True
+        count = 0
+        while True:
+            try:
+                item = self.q.get_nowait()
+            except queue.Empty:
+                break
+            await self.emit(item, asynchronous=True)  # type: ignore[attr-defined]
+            count += 1
+        if count:
+            logger.info(f"Drained {count} messages from buffer")
+
+
 @Stream.register_api()
-class FromAmqp(from_q):
+class FromAmqp(AsyncDelivery, from_q):
     """Read from AMQP source
 
     See https://en.wikipedia.org/wiki/AMQP for a description of the protocol
@@ -27,18 +117,56 @@ class FromAmqp(from_q):
 
     TODO: See also ``sinks.to_amqp``.
 
+    Messages are handed over from the consumer threads to the pipeline through a
+    bounded buffer, see ``BoundedBuffer``. Its size also caps the AMQP prefetch
+    count, so the broker does not deliver more messages than the buffer can take.
+
+    With ``consumers=N``, the source runs N consumers per queue, each one using
+    its own connection, consumer thread, and prefetch window, all feeding the
+    same buffer. ``queue`` accepts a list of queue names, separated by commas.
+
+    With ``ack=batch``, messages are not acknowledged on receipt. Instead, the
+    pipeline acknowledges each batch per ``acknowledge``, after the sink has
+    written it, or rejects it per ``reject``, when writing it failed.
+
+    With ``prefetch-adaptive=true``, the prefetch count of each consumer is
+    tuned periodically, see ``tune_prefetch``.
+
     :param uri: str
     :param reconnect: bool
     """
 
+    PREFETCH_TUNING_INTERVAL = 1.0
+
     def __init__(self, address: StreamAddress, **kwargs):
         self.address = address
         self.stopped = True
+        self.consuming = False
+        self.consumers = self.create_consumers()
+        self._prefetch_tuner: t.Optional[PeriodicCallback] = None
+        buffer = BoundedBuffer.from_options(
+            address.options,
+            spill_encode=BusMessage.detach,
+            spill_decode=functools.partial(BusMessage.attach, stream=self),
+        )
+        self._setup_delivery(address.options)
+        super().__init__(q=buffer, **kwargs)
+
+    def create_consumers(self) -> t.List[t.Any]:
+        """
+        Create ``consumers`` consumers for each queue.
+        """
+        count = int(self.address.options.get("consumers", 1))
+        if count < 1:
+            raise ValueError(f"Number of consumers must be at least 1: {count}")
+        queues = self.address.options.get("queue") or [None]
+        return [self.consumer_factory(queue) for queue in queues for _ in range(count)]
+
+    def consumer_factory(self, queue: t.Optional[str] = None):
         consumer_class: t.Callable = AMQPAdapter
         if self.address.options.get("reconnect", True):
             consumer_class = ReconnectingAMQPAdapter
-        self.consumer = consumer_class(address=address, on_message=self._on_message)
-        super().__init__(q=queue.Queue(), **kwargs)
+        return consumer_class(address=self.address, on_message=self._on_message, queue=queue)
 
     def _delivery_to_dict(self, basic_deliver):
         deliver_attrs = ["consumer_tag", "delivery_tag", "redelivered", "exchange", "routing_key"]
@@ -56,33 +184,134 @@ class FromAmqp(from_q):
 
     def _on_message(self, channel, basic_deliver, properties, body):
         busmsg = BusMessage.from_amqp_pika(self, channel, basic_deliver, properties, body)
-        self.q.put(busmsg)
+        self.deliver(busmsg)
 
     async def run(self):
-        AsyncThreadTask(self.consumer.run).run()
+        # Create new consumers when the source has been stopped and started again.
+        if not self.consumers:
+            self.consumers = self.create_consumers()
+        # Run each consumer on a dedicated thread, not occupying the loop's default executor.
+        for index, consumer in enumerate(self.consumers):
+            AsyncThreadTask(consumer.run).start_thread(name=f"lorry-amqp-{index}")
+        self.consuming = True
+        if self.address.options.get("prefetch-adaptive", False):
+            self._prefetch_tuner = PeriodicCallback(self.tune_prefetch, self.PREFETCH_TUNING_INTERVAL * 1000)
+            self._prefetch_tuner.start()
         await super().run()
 
     def stop(self):
         # TODO: Does not work with CTRL+C yet. Validate if it works on other occasions at least.
-        if not self.stopped:
-            self.consumer.stop()
-            self.consumer = None
+        if self._prefetch_tuner is not None:
+            self._prefetch_tuner.stop()
+            self._prefetch_tuner = None
+        if self.consuming:
+            for consumer in self.consumers:
+                consumer.stop()
+            self.consumers = []
+            self.consuming = False
             self.stopped = True
         super().stop()
 
+    async def drain(self):
+        """
+        Stop consuming, but keep the connections open, so the drained messages can still be acknowledged.
+        """
+        if self.consuming:
+            for consumer in self.consumers:
+                consumer.pause()
+        await super().drain()
+
+    def tune_prefetch(self):
+        """
+        Adjust the prefetch count of each consumer to how well the pipeline keeps up.
+
+        When the buffer fills up, because the sink lags behind, halve the prefetch
+        count, down to one. When the buffer is almost empty, and the prefetch window
+        is the bottleneck, double it, up to the consumer's share of the buffer size.
+        The window is the bottleneck when the number of unacknowledged messages is
+        close to the prefetch count, with ``ack=batch``. With ``ack=message``,
+        messages are acknowledged on receipt, so an empty buffer is sufficient.
+        """
+        if not self.consumers:
+            return
+        limit = t.cast(BoundedBuffer, self.q).limit
+        fill = self.q.qsize() / limit
+        maximum = max(limit // len(self.consumers), 1)
+        ack_batch = self.address.options.get("ack") == "batch"
+        for consumer in self.consumers:
+            count = consumer.prefetch_count
+            if fill >= 0.5:
+                count = max(count // 2, 1)
+            elif fill <= 0.1 and (not ack_batch or consumer.unacknowledged_count >= count * 0.9):
+                count = min(count * 2, maximum)
+            consumer.set_prefetch_count(count)
+
+    def acknowledge(self, batch: t.Sequence[BusMessage]):
+        """
+        Acknowledge all messages of a batch, using one acknowledgement per AMQP channel.
+        """
+        for channel, delivery_tag in self._latest_delivery_tags(batch).items():
+            consumer = self._find_consumer(channel)
+            if consumer is not None:
+                consumer.acknowledge_messages(channel, delivery_tag)
+
+    def reject(self, batch: t.Sequence[BusMessage]):
+        """
+        Reject all messages of a batch, so the broker delivers them again.
+        """
+        for channel, delivery_tag in self._latest_delivery_tags(batch).items():
+            consumer = self._find_consumer(channel)
+            if consumer is not None:
+                consumer.reject_messages(channel, delivery_tag)
+
+    def _find_consumer(self, channel):
+        """
+        Find the consumer owning an AMQP channel. Channels of closed connections have no owner anymore.
+        """
+        for consumer in self.consumers:
+            if consumer.has_channel(channel):
+                return consumer
+        logger.info("Channel has been closed, broker will redeliver its unacknowledged messages")
+        return None
+
+    @staticmethod
+    def _latest_delivery_tags(batch: t.Sequence[BusMessage]) -> t.Dict[t.Any, int]:
+        latest = {}
+        for busmsg in batch:
+            latest[busmsg.connection.channel] = busmsg.data.meta["delivery_tag"]  # type: ignore[index]
+        return latest
+
 
 @Stream.register_api()
-class FromMqttPlus(from_mqtt):
-    def __init__(self, uri: URL, client_kwargs=None, **kwargs):
+class FromMqttPlus(AsyncDelivery, from_mqtt):
+    """Read from MQTT source
+
+    Messages are handed over from the network thread of the MQTT client to
+    the pipeline through a bounded buffer, see ``BoundedBuffer``.
+
+    :param address: StreamAddress or URL
+    """
+
+    def __init__(self, address: t.Union[StreamAddress, URL], client_kwargs=None, **kwargs):
+        if isinstance(address, URL):
+            address = StreamAddress(uri=address)
+        self.address = address
+        uri = address.uri
         host = uri.host or "localhost"
         port = uri.port or uri.default_port
         topic = uri.path_unquoted.lstrip("/")
         logger.info(f"Subscribing to MQTT topic '{topic}' at broker on '{host}")
+        self._setup_delivery(address.options)
         super().__init__(host, port, topic, keepalive=60, client_kwargs=client_kwargs, **kwargs)
+        self.q = BoundedBuffer.from_options(
+            address.options,
+            spill_encode=BusMessage.detach,
+            spill_decode=functools.partial(BusMessage.attach, stream=self),
+        )
 
     def _on_message(self, client, userdata, msg):
         busmsg = BusMessage.from_mqtt_paho(self, client, userdata, msg)
-        self.q.put(busmsg)
+        self.deliver(busmsg)
 
 
 from_amqp = FromAmqp
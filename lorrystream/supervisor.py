@@ -0,0 +1,247 @@
+"""
+Run channels on multiple worker processes, in order to use all CPU cores
+for decoding and transforming messages.
+
+Each worker process runs its own ``Engine`` on its own asyncio loop. A
+channel can either be assigned to a single worker as a whole, or it can be
+split into multiple replicas, where each worker consumes a hash-partition
+of the channel's messages. The supervisor starts the workers, restarts them
+when they die, and merges the metrics they report.
+"""
+
+import asyncio
+import dataclasses
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+import typing as t
+from collections import defaultdict
+
+from lorrystream.model import BatchPolicy
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class ChannelSpec:
+    """
+    Picklable definition of a channel, to be materialized within a worker process.
+    """
+
+    source: str
+    sink: t.Optional[str] = None
+    name: t.Optional[str] = None
+    batch: t.Optional[BatchPolicy] = None
+    replicas: int = 1
+
+
+@dataclasses.dataclass
+class WorkerTask:
+    """
+    A channel, or a hash-partition of it, assigned to a worker process.
+    """
+
+    spec: ChannelSpec
+    name: str
+    shard: t.Optional[t.Tuple[int, int]] = None
+
+
+def assign(specs: t.List[ChannelSpec], workers: int) -> t.List[t.List[WorkerTask]]:
+    """
+    Distribute channels and their replicas round-robin across workers.
+    """
+    if workers < 1:
+        raise ValueError("Number of workers must be at least 1")
+    assignments: t.List[t.List[WorkerTask]] = [[] for _ in range(workers)]
+    position = 0
+    for number, spec in enumerate(specs, start=1):
+        if not 1 <= spec.replicas <= workers:
+            raise ValueError(f"Number of replicas must be between 1 and the number of workers: {spec.replicas}")
+        name = spec.name or f"channel-{number}"
+        for replica in range(spec.replicas):
+            shard = (replica, spec.replicas) if spec.replicas > 1 else None
+            assignments[position % workers].append(WorkerTask(spec=spec, name=name, shard=shard))
+            position += 1
+    return assignments
+
+
+def worker_main(index: int, tasks: t.List[WorkerTask], metrics_queue: multiprocessing.Queue, interval: float):
+    """
+    Entrypoint of a worker process.
+    """
+    from lorrystream.util.common import setup_logging
+
+    setup_logging(level=logging.INFO)
+    asyncio.run(_worker_run(index, tasks, metrics_queue, interval))
+
+
+async def _worker_run(index: int, tasks: t.List[WorkerTask], metrics_queue: multiprocessing.Queue, interval: float):
+    from lorrystream.core import ChannelFactory, Engine
+
+    engine = Engine()
+    counters: t.Dict[str, t.Dict[str, int]] = defaultdict(lambda: {"messages": 0, "batches": 0})
+
+    def counter(name: str):
+        def count(batch):
+            counters[name]["messages"] += len(batch)
+            counters[name]["batches"] += 1
+
+        return count
+
+    for task in tasks:
+        spec = task.spec
+        channel = ChannelFactory(
+            source=spec.source, sink=spec.sink, batch=spec.batch, name=task.name, shard=task.shard
+        ).channel()
+        channel.tap(counter(task.name))
+        engine.register(channel)
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, engine.terminate)
+    loop.add_signal_handler(signal.SIGINT, engine.terminate)
+
+    async def report():
+        while True:
+            await asyncio.sleep(interval)
+            metrics_queue.put((index, {name: dict(values) for name, values in counters.items()}))
+
+    reporter = asyncio.create_task(report())
+    logger.info(f"Worker {index} running channels: {[task.name for task in tasks]}")
+    try:
+        await engine.run_forever()
+    finally:
+        reporter.cancel()
+        engine.stop()
+
+
+async def run_sharded(
+    source_uri: str, sink_uri: t.Optional[str], workers: t.Optional[int] = None, batch: t.Optional[BatchPolicy] = None
+):
+    """
+    Run a single channel on multiple worker processes, each one consuming a share of its messages.
+
+    :param source_uri: Source element URI
+    :param sink_uri: Sink element URI
+    :param workers: Number of worker processes, defaults to the number of CPU cores
+    :param batch: Batching policy, overriding the ``batch-*`` URI query parameters
+    """
+    workers = workers or multiprocessing.cpu_count()
+    spec = ChannelSpec(source=source_uri, sink=sink_uri, batch=batch, replicas=workers)
+    supervisor = Supervisor([spec], workers=workers)
+    await supervisor.run_forever()
+
+
+class Supervisor:
+    """
+    Start worker processes running channels, restart them when they die, and merge their metrics.
+
+    :param specs: Channel definitions.
+    :param workers: Number of worker processes.
+    :param restart_delay: Number of seconds to wait before restarting a worker which died.
+    :param interval: Number of seconds between metrics reports of workers.
+    """
+
+    def __init__(
+        self,
+        specs: t.List[ChannelSpec],
+        workers: t.Optional[int] = None,
+        restart_delay: float = 1.0,
+        interval: float = 5.0,
+        target: t.Callable = worker_main,
+    ):
+        self.assignments = assign(specs, workers or multiprocessing.cpu_count())
+        self.restart_delay = restart_delay
+        self.interval = interval
+        self.target = target
+        self.context = multiprocessing.get_context("spawn")
+        self.metrics_queue = self.context.Queue()
+        self.processes: t.Dict[int, multiprocessing.process.BaseProcess] = {}
+        self.restarts: t.Dict[int, int] = defaultdict(int)
+        self.reports: t.Dict[int, t.Dict[str, t.Dict[str, int]]] = {}
+        self._died_at: t.Dict[int, float] = {}
+        self._terminate_event = asyncio.Event()
+
+    def start(self):
+        for index in range(len(self.assignments)):
+            self.start_worker(index)
+
+    def start_worker(self, index: int):
+        process = self.context.Process(
+            target=self.target,
+            args=(index, self.assignments[index], self.metrics_queue, self.interval),
+            name=f"lorry-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        logger.info(f"Started worker {index} with pid {process.pid}")
+        self.processes[index] = process
+
+    def supervise(self):
+        """
+        Collect metrics reports, and restart workers which died.
+        """
+        while True:
+            try:
+                index, report = self.metrics_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.reports[index] = report
+
+        now = time.monotonic()
+        for index, process in self.processes.items():
+            if process.is_alive():
+                continue
+            if index not in self._died_at:
+                logger.warning(f"Worker {index} died with exit code {process.exitcode}")
+                self._died_at[index] = now
+            if now - self._died_at[index] >= self.restart_delay:
+                del self._died_at[index]
+                self.restarts[index] += 1
+                self.start_worker(index)
+
+    def metrics(self) -> t.Dict[str, t.Dict[str, int]]:
+        """
+        Merge the most recent metrics reports of all workers, per channel.
+        """
+        merged: t.Dict[str, t.Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        for report in self.reports.values():
+            for name, values in report.items():
+                for key, value in values.items():
+                    merged[name][key] += value
+        return {name: dict(values) for name, values in merged.items()}
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Signal all workers to terminate, and wait for them.
+        """
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for index, process in self.processes.items():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"Worker {index} did not terminate in time, killing it")
+                process.kill()
+                process.join()
+
+    def terminate(self):
+        self._terminate_event.set()
+
+    async def run_forever(self, poll_interval: float = 0.5):
+        self.start()
+        last_report = time.monotonic()
+        try:
+            while not self._terminate_event.is_set():
+                try:
+                    await asyncio.wait_for(self._terminate_event.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.supervise()
+                if time.monotonic() - last_report >= self.interval:
+                    last_report = time.monotonic()
+                    logger.info(f"Metrics: {self.metrics()}")
+        finally:
+            self.stop()
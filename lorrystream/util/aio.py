@@ -1,5 +1,9 @@
 import asyncio
 import functools
+import threading
+import typing as t
+
+from tornado.ioloop import IOLoop
 
 
 def make_sync(func):
@@ -16,6 +20,17 @@ def make_sync(func):
     return wrapper
 
 
+def get_running_io_loop() -> t.Optional[IOLoop]:
+    """
+    Return the Tornado wrapper of the running asyncio event loop, or `None` when no loop is running.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    return IOLoop.current()
+
+
 def tornado_asyncio_run_forever():
     from tornado.platform.asyncio import AsyncIOMainLoop
 
@@ -51,6 +66,14 @@ class AsyncThreadTask:
         coro = asyncio.to_thread(self._thread)
         return asyncio.create_task(coro)
 
+    def start_thread(self, name: t.Optional[str] = None) -> threading.Thread:
+        """
+        Start the function on a dedicated daemon thread, instead of the default executor of the running loop.
+        """
+        thread = threading.Thread(target=self._thread, name=name, daemon=True)
+        thread.start()
+        return thread
+
     def _thread(self):
         asyncio.set_event_loop(self.loop)
         return self.func(*self.args, **self.kwargs)
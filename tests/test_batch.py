@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import pytest
+from streamz import Stream
+
+from lorrystream.model import BatchPolicy, StreamAddress
+from lorrystream.streamz.batch import acknowledge, micro_batch  # noqa: F401
+
+
+def test_batch_policy_from_url():
+    address = StreamAddress.from_url(
+        "mqtt://localhost/testdrive/%23?batch-size=500&batch-bytes=65536&batch-timeout=1.5&batch-adaptive=true"
+    )
+    policy = BatchPolicy.from_options(address.options)
+    assert policy == BatchPolicy(size=500, bytes=65536, timeout=1.5, adaptive=True)
+    assert "batch-size" not in str(address.uri)
+
+
+def test_batch_policy_sink_options_removed_from_uri():
+    address = StreamAddress.resolve_sink("crate://localhost/?table=testdrive&batch-size=42")
+    assert address.options == {"batch-size": 42}
+    assert str(address.uri) == "crate://localhost/?table=testdrive"
+
+
+@pytest.mark.asyncio
+async def test_micro_batch_size():
+    source = Stream(asynchronous=True)
+    results = source.micro_batch(policy=BatchPolicy(size=3, timeout=None)).sink_to_list()
+    for i in range(7):
+        await source.emit(i)
+    assert results == [(0, 1, 2), (3, 4, 5)]
+
+
+@pytest.mark.asyncio
+async def test_micro_batch_bytes():
+    source = Stream(asynchronous=True)
+    results = source.micro_batch(policy=BatchPolicy(size=100, bytes=8, timeout=None)).sink_to_list()
+    for item in [b"abc", b"defg", b"h", b"ijklmnop", b"q"]:
+        await source.emit(item)
+    assert results == [(b"abc", b"defg", b"h"), (b"ijklmnop",)]
+
+
+@pytest.mark.asyncio
+async def test_micro_batch_timeout():
+    source = Stream(asynchronous=True)
+    results = source.micro_batch(policy=BatchPolicy(size=100, timeout=0.05)).sink_to_list()
+    await source.emit(1)
+    await source.emit(2)
+    assert results == []
+    await asyncio.sleep(0.15)
+    assert results == [(1, 2)]
+
+
+@pytest.mark.asyncio
+async def test_micro_batch_adaptive():
+    source = Stream(asynchronous=True)
+    policy = BatchPolicy(size=2, timeout=0.01, adaptive=True, size_max=8)
+    batcher = source.micro_batch(policy=policy)
+
+    def slow_sink(batch):
+        time.sleep(0.02)
+
+    batcher.sink(slow_sink)
+    for i in range(2 + 4 + 8):
+        await source.emit(i)
+    assert batcher.n == 8
+
+
+def test_acknowledge():
+    acked = []
+    rejected = []
+    source = Stream()
+    node = source.acknowledge(ack=acked.append, reject=rejected.append)
+
+    def sink(batch):
+        if "fail" in batch:
+            raise RuntimeError("Writing failed")
+
+    node.sink(sink)
+    source.emit(("foo", "bar"))
+    with pytest.raises(RuntimeError):
+        source.emit(("fail",))
+    assert acked == [("foo", "bar")]
+    assert rejected == [("fail",)]
+
+
+@pytest.mark.asyncio
+async def test_acknowledge_async():
+    acked = []
+    rejected = []
+    source = Stream(asynchronous=True)
+    node = source.acknowledge(ack=acked.append, reject=rejected.append)
+    futures = []
+
+    def sink(batch):
+        futures.append(asyncio.get_running_loop().create_future())
+        return futures[-1]
+
+    node.sink(sink)
+    ok = asyncio.ensure_future(source.emit(("foo",)))
+    failed = asyncio.ensure_future(source.emit(("fail",)))
+    await asyncio.sleep(0)
+    assert acked == []
+    futures[0].set_result(None)
+    futures[1].set_exception(RuntimeError("Writing failed"))
+    await ok
+    with pytest.raises(RuntimeError):
+        await failed
+    assert acked == [("foo",)]
+    assert rejected == [("fail",)]
@@ -0,0 +1,88 @@
+import queue
+import threading
+
+import pytest
+
+from lorrystream.model import StreamAddress
+from lorrystream.streamz.buffer import BoundedBuffer, OverflowPolicy
+from lorrystream.streamz.model import BusMessage, BusMessageConnection, BusMessageData
+
+
+def drain(buffer: BoundedBuffer):
+    items = []
+    while True:
+        try:
+            items.append(buffer.get_nowait())
+        except queue.Empty:
+            return items
+
+
+def test_buffer_from_options():
+    address = StreamAddress.from_url("mqtt://localhost/foo?buffer-size=42&buffer-overflow=drop-oldest")
+    buffer = BoundedBuffer.from_options(address.options)
+    assert buffer.limit == 42
+    assert buffer.overflow is OverflowPolicy.DROP_OLDEST
+
+
+def test_buffer_invalid_overflow():
+    with pytest.raises(ValueError):
+        BoundedBuffer(overflow="unknown")
+
+
+def test_buffer_block():
+    buffer = BoundedBuffer(maxsize=2, overflow="block")
+    buffer.put(1)
+    buffer.put(2)
+    with pytest.raises(queue.Full):
+        buffer.put(3, timeout=0.01)
+
+    # A blocked producer resumes as soon as there is room again.
+    producer = threading.Thread(target=buffer.put, args=(3,))
+    producer.start()
+    assert buffer.get() == 1
+    producer.join(timeout=1)
+    assert drain(buffer) == [2, 3]
+
+
+def test_buffer_drop_oldest():
+    buffer = BoundedBuffer(maxsize=3, overflow="drop-oldest")
+    for item in range(5):
+        buffer.put(item)
+    assert buffer.depth == 3
+    assert buffer.dropped == 2
+    assert drain(buffer) == [2, 3, 4]
+
+
+def test_buffer_spill_retains_order(tmp_path):
+    buffer = BoundedBuffer(maxsize=2, overflow="spill", spill_directory=str(tmp_path))
+    for item in range(5):
+        buffer.put(item)
+    assert buffer.depth == 5
+    assert buffer.spilled == 3
+    assert buffer.get() == 0
+    buffer.put(5)
+    assert drain(buffer) == [1, 2, 3, 4, 5]
+    assert buffer.depth == 0
+
+
+def test_buffer_spill_busmessage(tmp_path):
+    stream = object()
+    buffer = BoundedBuffer(
+        maxsize=1,
+        overflow="spill",
+        spill_directory=str(tmp_path),
+        spill_encode=BusMessage.detach,
+        spill_decode=lambda data: BusMessage.attach(data, stream=stream),
+    )
+    for payload in [b"foo", b"bar"]:
+        buffer.put(
+            BusMessage(
+                connection=BusMessageConnection(stream=stream, client=threading.Lock()),
+                data=BusMessageData(meta={"topic": "foo", "info": threading.Lock()}, payload=payload),
+            )
+        )
+    first, second = drain(buffer)
+    assert first.data.payload == b"foo"
+    assert second.data.payload == b"bar"
+    assert second.data.meta == {"topic": "foo"}
+    assert second.connection.stream is stream
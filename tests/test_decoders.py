@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from lorrystream.core import BatchDecoders, ChannelFactory
+from lorrystream.streamz.model import BusMessage, BusMessageConnection, BusMessageData
+
+
+def mkmessage(payload):
+    return BusMessage(connection=BusMessageConnection(), data=BusMessageData(payload=payload))
+
+
+def test_decode_busmessages_json():
+    batch = [mkmessage(b'{"temperature": 42.42}'), mkmessage('{"temperature": 43.43}')]
+    packets = BatchDecoders.decode_busmessages_json(batch)
+    assert [packet.payload for packet in packets] == [{"temperature": 42.42}, {"temperature": 43.43}]
+    assert [packet.busmsg for packet in packets] == batch
+
+
+def test_decode_busmessages_json_skip_invalid(caplog):
+    batch = [mkmessage(b'{"temperature": 42.42}'), mkmessage(b"{invalid"), mkmessage(None), mkmessage(b"[1, 2]")]
+    packets = BatchDecoders.decode_busmessages_json(batch)
+    assert [packet.payload for packet in packets] == [{"temperature": 42.42}, [1, 2]]
+    assert "Skipping message with invalid JSON payload" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_channel_decodes_json_batches():
+    results = []
+    channel = ChannelFactory(
+        source="mqtt://localhost/testdrive/%23?content-type=json&batch-size=2",
+        sink=results.append,
+    ).channel()
+    for value in range(4):
+        await channel.source.emit(mkmessage(f'{{"value": {value}}}'.encode()), asynchronous=True)
+    await asyncio.sleep(0)
+    assert [[packet.payload for packet in batch] for batch in results] == [
+        [{"value": 0}, {"value": 1}],
+        [{"value": 2}, {"value": 3}],
+    ]
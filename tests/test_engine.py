@@ -8,6 +8,9 @@ import pytest
 from testcontainers.rabbitmq import RabbitMqContainer
 
 from lorrystream.core import ChannelFactory, Engine
+from lorrystream.exceptions import InvalidChannelError
+from lorrystream.model import BatchPolicy, Channel, ChannelState
+from tests.util import SyntheticSource
 
 capmqtt_decode_utf8 = True
 
@@ -37,6 +40,74 @@ class engine_single_shot:
         return False
 
 
+class DummySource:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.started = 0
+        self.stopped = 0
+
+    def start(self):
+        if self.fail:
+            raise RuntimeError("Failed to start")
+        self.started += 1
+
+    def stop(self):
+        self.stopped += 1
+
+
+def test_engine_registry_names():
+    engine = Engine()
+    assert engine.register(Channel(source=DummySource(), pipeline=None, sink=None)) == "channel-1"
+    assert engine.register(Channel(source=DummySource(), pipeline=None, sink=None, name="foo")) == "foo"
+    assert engine.register(Channel(source=DummySource(), pipeline=None, sink=None), name="bar") == "bar"
+    assert list(engine.channels) == ["channel-1", "foo", "bar"]
+    with pytest.raises(InvalidChannelError) as ex:
+        engine.register(Channel(source=DummySource(), pipeline=None, sink=None, name="foo"))
+    assert ex.match("Channel already registered: foo")
+
+
+def test_engine_channel_lifecycle():
+    engine = Engine()
+    good = DummySource()
+    bad = DummySource(fail=True)
+    engine.register(Channel(source=good, pipeline=None, sink=None, name="good"))
+    engine.register(Channel(source=bad, pipeline=None, sink=None, name="bad"))
+
+    engine.start()
+    assert engine.states == {"good": ChannelState.RUNNING, "bad": ChannelState.FAILED}
+
+    assert engine.restart_channel("good") is True
+    assert good.started == 2
+    assert good.stopped == 1
+
+    engine.stop()
+    assert engine.states == {"good": ChannelState.STOPPED, "bad": ChannelState.FAILED}
+    assert good.stopped == 2
+    assert bad.stopped == 0
+
+    engine.unregister("good")
+    assert list(engine.channels) == ["bad"]
+    with pytest.raises(InvalidChannelError):
+        engine.restart_channel("good")
+
+
+@pytest.mark.asyncio
+async def test_engine_drain():
+    source = SyntheticSource(delivery="async")
+    batcher = source.micro_batch(policy=BatchPolicy(size=100, timeout=None))
+    results = batcher.sink_to_list()
+    engine = Engine()
+    engine.register(Channel(source=source, pipeline=None, sink=None, batcher=batcher, name="foo"))
+    engine.start()
+    for item in range(5):
+        source.q.put(item)
+
+    assert await engine.drain(timeout=1) is True
+    assert engine.states == {"foo": ChannelState.STOPPED}
+    assert results == [(0, 1, 2, 3, 4)]
+    assert source.q.empty()
+
+
 @pytest.mark.asyncio
 async def test_amqp_to_sql(rabbitmq: t.Tuple[RabbitMqContainer, pika.BlockingConnection], cratedb):
 
@@ -0,0 +1,74 @@
+import asyncio
+import urllib.request
+
+import pytest
+
+from lorrystream.core import ChannelFactory, Engine
+from lorrystream.metrics import ChannelMetrics, Histogram, MetricsServer
+from lorrystream.streamz.model import BusMessage, BusMessageConnection, BusMessageData
+
+
+def mkmessage(payload):
+    return BusMessage(connection=BusMessageConnection(), data=BusMessageData(payload=payload))
+
+
+def test_histogram():
+    histogram = Histogram([0.1, 1.0])
+    for value in [0.05, 0.1, 0.5, 5.0]:
+        histogram.observe(value)
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(5.65)
+    assert histogram.cumulative() == [("0.1", 2), ("1.0", 3), ("+Inf", 4)]
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.99) == float("inf")
+
+
+def test_timed_sink_error():
+    metrics = ChannelMetrics()
+
+    def fail(batch):
+        raise ValueError("Write failed")
+
+    with pytest.raises(ValueError):
+        metrics.timed_sink(fail)([1, 2])
+    assert metrics.errors == 1
+    assert metrics.messages_out == 0
+    assert metrics.sink_seconds.count == 1
+
+
+@pytest.mark.asyncio
+async def test_channel_metrics():
+    results = []
+    channel = ChannelFactory(
+        source="mqtt://localhost/testdrive/%23?content-type=json&batch-size=2",
+        sink=results.append,
+    ).channel()
+    for value in range(4):
+        await channel.source.emit(mkmessage(f'{{"value": {value}}}'.encode()), asynchronous=True)
+    await asyncio.sleep(0)
+
+    metrics = channel.metrics
+    assert metrics.messages_in == 4
+    assert metrics.bytes_in == 48
+    assert metrics.messages_out == 4
+    assert metrics.batches == 2
+    assert metrics.batch_size.sum == 4
+    assert metrics.decode_seconds.count == 2
+    assert metrics.sink_seconds.count == 2
+
+    engine = Engine()
+    engine.register(channel, name="foo")
+    text = engine.metrics_text()
+    assert 'lorry_messages_in_total{channel="foo"} 4' in text
+    assert 'lorry_batch_size_bucket{channel="foo",le="10"} 2' in text
+    assert 'lorry_queue_depth{channel="foo"} 0' in text
+
+
+def test_metrics_server():
+    server = MetricsServer(lambda: "lorry_up 1\n", host="127.0.0.1", port=0)
+    server.start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:  # noqa: S310
+            assert response.read() == b"lorry_up 1\n"
+    finally:
+        server.stop()
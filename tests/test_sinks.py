@@ -0,0 +1,144 @@
+import asyncio
+import concurrent.futures
+from unittest import mock
+
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+from pika.frame import Method
+from pika.spec import Basic
+from streamz import Stream
+
+from lorrystream.core import ChannelFactory
+from lorrystream.exceptions import InvalidSinkError
+from lorrystream.model import Packet, StreamAddress
+from lorrystream.streamz.amqp import AMQPPublisher, PendingBatch, PublishError
+from lorrystream.streamz.sinks import dataframe_to_sql, records_to_sql, to_amqp
+
+
+def read_table(dburi: str, table: str):
+    engine = sa.create_engine(dburi)
+    with engine.connect() as conn:
+        rows = conn.execute(sa.text(f"SELECT * FROM {table}")).mappings().all()  # noqa: S608
+    engine.dispose()
+    return [dict(row) for row in rows]
+
+
+def test_records_to_sql(tmp_path):
+    dburi = f"sqlite:///{tmp_path}/testdrive.sqlite"
+    source = Stream()
+    sink = records_to_sql(source, dburi=f"{dburi}?table=foo")
+    source.emit([{"id": 1, "name": "foo"}, {"id": 2, "name": "bar"}])
+    source.emit([{"name": "baz", "id": 3}, {"id": 4}])
+    sink.destroy()
+    assert read_table(dburi, "foo") == [
+        {"id": 1, "name": "foo"},
+        {"id": 2, "name": "bar"},
+        {"id": 3, "name": "baz"},
+        {"id": 4, "name": None},
+    ]
+
+
+def test_records_to_sql_replace(tmp_path):
+    dburi = f"sqlite:///{tmp_path}/testdrive.sqlite"
+    source = Stream()
+    sink = records_to_sql(source, dburi=f"{dburi}?table=foo&if_exists=replace")
+    source.emit([{"id": 1}])
+    source.emit([{"id": 2}])
+    sink.destroy()
+    assert read_table(dburi, "foo") == [{"id": 1}, {"id": 2}]
+
+
+def test_dataframe_to_sql(tmp_path):
+    dburi = f"sqlite:///{tmp_path}/testdrive.sqlite"
+    source = Stream()
+    sink = dataframe_to_sql(source, dburi=f"{dburi}?table=foo")
+    source.emit(pd.DataFrame.from_records([{"id": 1, "name": "foo"}]))
+    sink.destroy()
+    assert read_table(dburi, "foo") == [{"id": 1, "name": "foo"}]
+
+
+def test_channel_format_records(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dburi = "sqlite:///testdrive.sqlite"
+    channel = ChannelFactory(
+        source="mqtt://localhost/testdrive/%23?content-type=json",
+        sink=f"{dburi}?table=foo&format=records",
+    ).channel()
+    assert isinstance(channel.sink, records_to_sql)
+    channel.sink.upstream.upstream.emit([Packet(payload={"id": 1}, busmsg=None)])
+    channel.sink.destroy()
+    assert read_table(dburi, "foo") == [{"id": 1}]
+
+
+def test_channel_format_invalid():
+    with pytest.raises(InvalidSinkError):
+        ChannelFactory(
+            source="mqtt://localhost/testdrive/%23",
+            sink="sqlite:///testdrive.sqlite?table=foo&format=unknown",
+        ).channel()
+
+
+def test_amqp_publisher_confirms():
+    publisher = AMQPPublisher(StreamAddress.from_url("amqp://localhost/%2F?exchange=foo&routing-key=bar"))
+    publisher._channel = mock.Mock()
+    first = PendingBatch(concurrent.futures.Future(), 2)
+    second = PendingBatch(concurrent.futures.Future(), 3)
+
+    # Batches are held back until publisher confirms have been enabled.
+    publisher._publish([(b"1", None), (b"2", None)], first)
+    publisher._publish([(b"3", None), (b"4", None), (b"5", None)], second)
+    assert publisher._channel.basic_publish.call_count == 0
+    publisher.on_confirm_selectok(None)
+    assert publisher._channel.basic_publish.call_count == 5
+    publisher._channel.basic_publish.assert_called_with("foo", "bar", b"5", None)
+
+    # Batches are resolved when all of their messages have been confirmed.
+    publisher.on_delivery_confirmation(Method(1, Basic.Ack(delivery_tag=1)))
+    assert not first.future.done()
+    publisher.on_delivery_confirmation(Method(1, Basic.Ack(delivery_tag=3, multiple=True)))
+    assert first.future.result() == 2
+    assert not second.future.done()
+    publisher.on_delivery_confirmation(Method(1, Basic.Nack(delivery_tag=5, multiple=True)))
+    with pytest.raises(PublishError):
+        second.future.result()
+    assert publisher._unconfirmed == {}
+
+
+def test_amqp_publisher_connection_lost():
+    publisher = AMQPPublisher(StreamAddress.from_url("amqp://localhost/%2F?queue=foo"))
+    assert publisher.routing_key == "foo"
+    publisher._channel = mock.Mock()
+    publisher.on_confirm_selectok(None)
+    pending = PendingBatch(concurrent.futures.Future(), 1)
+    publisher._publish([(b"1", None)], pending)
+    with mock.patch.object(publisher.loop, "call_later") as call_later:
+        publisher.reconnect()
+    call_later.assert_called_once_with(0.0, publisher._reopen)
+    with pytest.raises(PublishError):
+        pending.future.result()
+
+
+@pytest.mark.asyncio
+async def test_channel_amqp_sink():
+    channel = ChannelFactory(
+        source="mqtt://localhost/testdrive/%23",
+        sink="amqp://localhost/%2F?exchange=foo",
+    ).channel()
+    assert isinstance(channel.sink, to_amqp)
+
+    def publish(messages):
+        future = concurrent.futures.Future()
+        future.set_result(len(messages))
+        return future
+
+    publisher = mock.Mock(publish=mock.Mock(side_effect=publish))
+    with mock.patch.object(channel.sink, "connect", lambda: setattr(channel.sink, "publisher", publisher)):
+        futures = channel.sink.upstream.upstream.emit([Packet(payload={"id": 1}), Packet(payload=b"raw")])
+        await asyncio.gather(*futures)
+    messages = publisher.publish.call_args.args[0]
+    assert [body for body, _ in messages] == [b'{"id":1}', b"raw"]
+    assert messages[0][1].content_type == "application/json"
+    assert channel.metrics.messages_out == 2
+    channel.sink.close()
+    publisher.stop.assert_called_once()
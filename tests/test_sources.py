@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import threading
+from unittest import mock
+
+import pytest
+from pika import BasicProperties
+from pika.spec import Basic
+from tornado.ioloop import IOLoop
+
+from lorrystream.model import StreamAddress
+from lorrystream.streamz.amqp import AMQPAdapter, ReconnectingAMQPAdapter
+from lorrystream.streamz.model import BusMessage, BusMessageConnection, BusMessageData
+from lorrystream.streamz.sources import FromAmqp
+from tests.util import SyntheticSource
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("delivery", ["async", "poll"])
+async def test_delivery_from_thread(delivery):
+    source = SyntheticSource(delivery=delivery, loop=IOLoop.current())
+    results = source.sink_to_list()
+    source.start()
+    await asyncio.sleep(0.05)
+
+    producer = threading.Thread(target=lambda: [source.deliver(item) for item in range(100)])
+    producer.start()
+    producer.join()
+    for _ in range(50):
+        if len(results) == 100:
+            break
+        await asyncio.sleep(0.01)
+    source.stop()
+    assert results == list(range(100))
+
+
+def test_delivery_invalid():
+    with pytest.raises(ValueError) as ex:
+        SyntheticSource(delivery="foo")
+    assert ex.match("Invalid delivery mode: foo")
+
+
+def test_amqp_ack_batch():
+    channel_a, channel_b = object(), object()
+    batch = [
+        BusMessage(BusMessageConnection(channel=channel_a), BusMessageData(meta={"delivery_tag": 1})),
+        BusMessage(BusMessageConnection(channel=channel_b), BusMessageData(meta={"delivery_tag": 1})),
+        BusMessage(BusMessageConnection(channel=channel_a), BusMessageData(meta={"delivery_tag": 2})),
+    ]
+    source = FromAmqp(StreamAddress.from_url("amqp://localhost/%2F?queue=foo&ack=batch&reconnect=false"))
+    consumer_a, consumer_b = mock.Mock(), mock.Mock()
+    consumer_a.has_channel.side_effect = lambda channel: channel is channel_a
+    consumer_b.has_channel.side_effect = lambda channel: channel is channel_b
+    source.consumers = [consumer_a, consumer_b]
+    source.acknowledge(batch)
+    assert consumer_a.acknowledge_messages.call_args_list == [mock.call(channel_a, 2)]
+    assert consumer_b.acknowledge_messages.call_args_list == [mock.call(channel_b, 1)]
+    source.reject(batch)
+    assert consumer_a.reject_messages.call_args_list == [mock.call(channel_a, 2)]
+    assert consumer_b.reject_messages.call_args_list == [mock.call(channel_b, 1)]
+
+
+def test_amqp_consumers():
+    source = FromAmqp(
+        StreamAddress.from_url("amqp://localhost/%2F?queue=foo,bar&consumers=2&buffer-size=100&reconnect=false")
+    )
+    assert [consumer.queue_name for consumer in source.consumers] == ["foo", "foo", "bar", "bar"]
+    assert [consumer._prefetch_count for consumer in source.consumers] == [25, 25, 25, 25]
+
+
+def test_amqp_ack_invalid():
+    with pytest.raises(ValueError) as ex:
+        FromAmqp(StreamAddress.from_url("amqp://localhost/%2F?queue=foo&ack=foo"))
+    assert ex.match("Invalid acknowledgement mode: foo")
+
+
+def test_amqp_log_sample(caplog):
+    address = StreamAddress.from_url("amqp://localhost/%2F?queue=foo&log-sample=3")
+    consumer = AMQPAdapter(address=address, on_message=mock.Mock())
+    consumer._channel = mock.Mock()
+    caplog.set_level(logging.INFO, logger="lorrystream.streamz.amqp")
+    caplog.clear()
+    for delivery_tag in range(1, 7):
+        consumer.on_message(None, Basic.Deliver(delivery_tag=delivery_tag), BasicProperties(), b"{}")
+    assert consumer.received_count == consumer.acknowledged_count == 6
+    assert [record.message for record in caplog.records] == [
+        "Received message # 3 from None: b'{}'",
+        "Received message # 6 from None: b'{}'",
+    ]
+
+
+def test_amqp_prefetch_options():
+    source = FromAmqp(
+        StreamAddress.from_url("amqp://localhost/%2F?queue=foo&prefetch-count=50&prefetch-size=4096&reconnect=false")
+    )
+    consumer = source.consumers[0]
+    assert consumer.prefetch_count == 50
+    assert consumer._prefetch_size == 4096
+
+
+@pytest.mark.parametrize(
+    "ack,depth,unacknowledged,expected",
+    [
+        ("message", 0, 0, 200),
+        ("message", 600, 0, 50),
+        ("message", 300, 0, 100),
+        ("batch", 0, 0, 100),
+        ("batch", 0, 95, 200),
+    ],
+)
+def test_amqp_tune_prefetch(ack, depth, unacknowledged, expected):
+    source = FromAmqp(
+        StreamAddress.from_url(f"amqp://localhost/%2F?queue=foo&prefetch-count=100&buffer-size=1000&ack={ack}")
+    )
+    consumer = mock.Mock(prefetch_count=100, unacknowledged_count=unacknowledged)
+    source.consumers = [consumer, mock.Mock(prefetch_count=100, unacknowledged_count=unacknowledged)]
+    for item in range(depth):
+        source.q.put(item)
+    source.tune_prefetch()
+    consumer.set_prefetch_count.assert_called_once_with(expected)
+
+
+def test_amqp_reconnect_delay():
+    address = StreamAddress.from_url("amqp://localhost/%2F?queue=foo")
+    adapter = ReconnectingAMQPAdapter(address=address)
+    delays = [adapter._get_reconnect_delay() for _ in range(10)]
+    assert delays[0] == 0
+    for attempt, delay in enumerate(delays[1:], start=1):
+        assert 0 <= delay <= min(adapter.RECONNECT_DELAY_MAX, adapter.RECONNECT_DELAY_BASE * 2 ** (attempt - 1))
+    adapter._consumer.was_consuming = True
+    assert adapter._get_reconnect_delay() == 0
+
+
+def test_amqp_reconnect_reuses_topology():
+    address = StreamAddress.from_url("amqp://localhost/%2F?queue=foo&setup=queue")
+    adapter = ReconnectingAMQPAdapter(address=address)
+    assert adapter._consumer.needs_setup("queue") is True
+
+    # Reconnecting after the topology has been declared skips declaring it again.
+    adapter._consumer.should_reconnect = True
+    adapter._consumer.topology_declared = True
+    with mock.patch.object(adapter, "_get_reconnect_delay", return_value=0):
+        adapter._maybe_reconnect()
+    assert adapter._consumer.needs_setup("queue") is False
+
+    # Reconnecting after the queue vanished declares it again.
+    adapter._consumer.should_reconnect = True
+    adapter._consumer.topology_lost = True
+    with mock.patch.object(adapter, "_get_reconnect_delay", return_value=0):
+        adapter._maybe_reconnect()
+    assert adapter._consumer.needs_setup("queue") is True
@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from lorrystream.core import ShardFilter
+from lorrystream.streamz.model import BusMessage, BusMessageConnection, BusMessageData
+from lorrystream.supervisor import ChannelSpec, Supervisor, assign
+
+
+def test_assign_channels_round_robin():
+    specs = [
+        ChannelSpec(source="mqtt://localhost/foo", name="foo"),
+        ChannelSpec(source="mqtt://localhost/bar", name="bar", replicas=2),
+        ChannelSpec(source="mqtt://localhost/baz"),
+    ]
+    assignments = assign(specs, workers=2)
+    assert [[(task.name, task.shard) for task in tasks] for tasks in assignments] == [
+        [("foo", None), ("bar", (1, 2))],
+        [("bar", (0, 2)), ("channel-3", None)],
+    ]
+
+
+def test_assign_too_many_replicas():
+    with pytest.raises(ValueError) as ex:
+        assign([ChannelSpec(source="mqtt://localhost/foo", replicas=3)], workers=2)
+    assert ex.match("Number of replicas must be between 1 and the number of workers: 3")
+
+
+def test_shard_filter_partitions_messages():
+    shards = [ShardFilter(index, 3) for index in range(3)]
+    for number in range(100):
+        payload = f'{{"value": {number}}}'.encode()
+        busmsg = BusMessage(connection=BusMessageConnection(), data=BusMessageData(payload=payload))
+        assert sum(shard(busmsg) for shard in shards) == 1
+
+
+def exit_immediately(index, tasks, metrics_queue, interval):
+    metrics_queue.put((index, {task.name: {"messages": 21, "batches": 1} for task in tasks}))
+
+
+def test_supervisor_restarts_workers_and_merges_metrics():
+    spec = ChannelSpec(source="mqtt://localhost/foo", name="foo", replicas=2)
+    supervisor = Supervisor([spec], workers=2, restart_delay=0.0, target=exit_immediately)
+    supervisor.start()
+    try:
+        deadline = time.monotonic() + 30
+        while sum(supervisor.restarts.values()) < 2 and time.monotonic() < deadline:
+            supervisor.supervise()
+            time.sleep(0.1)
+    finally:
+        supervisor.stop()
+    assert sum(supervisor.restarts.values()) >= 2
+    assert supervisor.metrics() == {"foo": {"messages": 42, "batches": 2}}
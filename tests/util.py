@@ -2,6 +2,11 @@ import random
 import typing as t
 from pathlib import Path
 
+from streamz import from_q
+
+from lorrystream.streamz.buffer import BoundedBuffer
+from lorrystream.streamz.sources import AsyncDelivery
+
 BACKENDS = ["streamz", "tributary"]
 
 
@@ -10,3 +15,13 @@ def random_table_name(label: t.Union[Path, str]):
     if isinstance(label, Path):
         name = label.name
     return f"lorrystream-test-{name}-{random.randint(1, 9999)}"  # noqa: S311
+
+
+class SyntheticSource(AsyncDelivery, from_q):
+    """
+    A source element fed by calling ``deliver``, standing in for broker client threads.
+    """
+
+    def __init__(self, delivery: str, **kwargs):
+        self._setup_delivery({"delivery": delivery})
+        super().__init__(q=BoundedBuffer(), **kwargs)